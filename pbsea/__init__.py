@@ -1,4 +1,15 @@
 import pandas as pa
 
-from pbsea.pbsea import PandasBasedEnrichmentAnalysis, AnnotationEnrichmentAnalysis, EnrichmentAnalysisExperimental
-from pbsea.preprocessing import counting_objects, preprocessing_files, go_translation_dictionary_creation, ec_translation_dictionary_creation, interpro_translation_dictionary_creation
+from pbsea.pbsea import PandasBasedEnrichmentAnalysis, AnnotationEnrichmentAnalysis, EnrichmentAnalysisExperimental, AnalysisCancelled
+from pbsea.lazy import LazyEnrichmentResult
+from pbsea.preprocessing import counting_objects, preprocessing_files, go_translation_dictionary_creation, ec_translation_dictionary_creation, interpro_translation_dictionary_creation, \
+                                go_parents_dictionary_creation, \
+                                gene_sets_dictionary_creation, incidence_matrix_creation, counting_objects_multiple_namespaces, identical_gene_sets_grouping
+from pbsea.clustering import functional_annotation_clustering, kappa_similarity
+from pbsea.batch import BatchJournal, batch_enrichment_analysis, manifest_creation
+from pbsea.namespaces import multiple_namespaces_enrichment_analysis
+from pbsea.ranked import RankedEnrichmentAnalysis, exact_mhg_pvalues, minimum_hypergeometric_test
+from pbsea.reference import EnrichmentReference, enrichment_analysis_on_reference
+from pbsea.snapshot import ReferenceSnapshot, reference_snapshot_creation, write_reference_snapshot
+from pbsea.store import EnrichmentResultStore, ResultRunWriter
+from pbsea.topology import TopologyEnrichmentAnalysis, topological_order
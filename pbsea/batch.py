@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import csv
+import hashlib
+import json
+import logging
+import os
+import pandas as pa
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from pbsea.pbsea import PandasBasedEnrichmentAnalysis
+from pbsea.reference import EnrichmentReference, enrichment_analysis_on_reference
+from pbsea.snapshot import ReferenceSnapshot
+
+logger = logging.getLogger(__name__)
+
+_opened_references = {}
+_opened_references_lock = threading.Lock()
+
+
+class BatchJournal():
+    '''
+    SQLite journal of the analyses of a batch: for each list of interest, the hash of its input
+    (genes, parameters and reference), the path of its result file and its status ('done' or 'failed').
+    Each analysis is committed when it ends, so the journal stays valid after a crash.
+    '''
+    def __init__(self, path_journal):
+        self._connection = sqlite3.connect(path_journal)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS analyses (list_name TEXT PRIMARY KEY, input_hash TEXT NOT NULL, '
+                                 'output_path TEXT, status TEXT NOT NULL, message TEXT, number_of_genes_found INTEGER, finished_at REAL)')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def finished_analyses(self):
+        '''
+        Return a dictionary with the name of the finished lists as key and a tuple (input hash, path of the result file) as value.
+        '''
+        rows = self._connection.execute("SELECT list_name, input_hash, output_path FROM analyses WHERE status = 'done'")
+
+        return {list_name: (input_hash, output_path) for list_name, input_hash, output_path in rows}
+
+    def is_finished(self, list_name, input_hash):
+        '''
+        An analysis is finished if it has been done with the same input and its result file still exists.
+        '''
+        row = self._connection.execute("SELECT output_path FROM analyses WHERE list_name = ? AND input_hash = ? AND status = 'done'",
+                                       (list_name, input_hash)).fetchone()
+
+        return row is not None and os.path.exists(row[0])
+
+    def recording_analysis(self, list_name, input_hash, output_path, status, message=None, number_of_genes_found=None):
+        self._connection.execute('INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (list_name, input_hash, output_path, status, message, number_of_genes_found, time.time()))
+        self._connection.commit()
+
+
+def reference_fingerprint(reference):
+    '''
+    Hash of the objects, of their counts and of the number of genes of a reference,
+    so the analyses are done again if the reference changes.
+    '''
+    reference_hash = hashlib.sha256()
+    reference_hash.update('\t'.join(map(str, reference.analyzed_objects)).encode('utf-8'))
+    reference_hash.update(reference.reference_counts.astype('<i8').tobytes())
+    reference_hash.update(str(reference.number_of_genes_in_reference).encode('utf-8'))
+
+    return reference_hash.hexdigest()
+
+def interest_list_hash(interest_genes, parameters):
+    '''
+    Hash of a list of genes of interest (without order and duplicates) and of the parameters of its analysis.
+    '''
+    interest_hash = hashlib.sha256()
+    interest_hash.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+    interest_hash.update('\n'.join(sorted(set(map(str, interest_genes)))).encode('utf-8'))
+
+    return interest_hash.hexdigest()
+
+def manifest_creation(name_path_manifest, index_column):
+    '''
+    Read a manifest file with two columns: the name of each list of interest (ListName) and the path
+    of its file (Path), a file like the interest file of counting_objects (the genes in index_column).
+    Return a dictionary with the name of the list as key and the list of its genes as value.
+    '''
+    df_manifest = pa.read_csv(name_path_manifest, sep=None, engine="python", na_values="")
+    manifest_directory = os.path.dirname(name_path_manifest)
+
+    manifest = {}
+    for list_name, path_interest in zip(df_manifest['ListName'], df_manifest['Path']):
+        df_interest = pa.read_csv(os.path.join(manifest_directory, path_interest), sep='\t', engine="python", na_values="")
+        manifest[list_name] = df_interest[index_column].dropna().tolist()
+
+    return manifest
+
+def _opening_reference(reference):
+    '''
+    A reference given as the path of a snapshot is opened once in each worker process (or once for all the threads),
+    it is opened again if the snapshot has been written again: only the last version of each path is kept
+    and the previous snapshot is closed (its mapping is released when the analyses using it end).
+    '''
+    if isinstance(reference, EnrichmentReference):
+        return reference
+
+    path_snapshot = os.path.abspath(reference)
+    snapshot_status = os.stat(path_snapshot)
+    snapshot_version = (snapshot_status.st_mtime_ns, snapshot_status.st_size)
+    with _opened_references_lock:
+        if path_snapshot not in _opened_references or _opened_references[path_snapshot][0] != snapshot_version:
+            if path_snapshot in _opened_references:
+                _opened_references.pop(path_snapshot)[2].close()
+            snapshot = ReferenceSnapshot(path_snapshot)
+            _opened_references[path_snapshot] = (snapshot_version, EnrichmentReference.from_snapshot(snapshot), snapshot)
+
+        return _opened_references[path_snapshot][1]
+
+def _running_batch_analysis(reference, interest_genes, output_path, alpha, threshold_normal_approximation, analysis_class):
+    reference = _opening_reference(reference)
+
+    interest_counts, number_of_genes_found = reference.counting_objects_in_interest(interest_genes)
+
+    # A list without annotated gene has nothing to test: its result is empty (and it is not analyzed again).
+    if number_of_genes_found == 0 or len(interest_counts.index) == 0:
+        logger.info('No annotated gene in the list of interest, empty result written in %s', output_path)
+        df = reference.dataframe_of_interest(interest_counts)
+    else:
+        df, significative_objects = enrichment_analysis_on_reference(reference, interest_counts, number_of_genes_found, alpha,
+                                                                     threshold_normal_approximation, analysis_class)
+
+    # The result is renamed when it is complete, so a crash never leaves a half-written result file.
+    with open(output_path + '.tmp', 'w') as output_file:
+        output_file.write("# Number of objects in reference : " + str(reference.number_of_genes_in_reference) +
+                          "\t Number of objects in interest : " + str(number_of_genes_found) + "\n")
+        df.to_csv(output_file, sep="\t", float_format='%.6f', index=True, header=True, quoting=csv.QUOTE_NONE)
+    os.replace(output_path + '.tmp', output_path)
+
+    return number_of_genes_found
+
+def batch_enrichment_analysis(reference, manifest, output_directory, alpha, threshold_normal_approximation,
+                              path_journal=None, number_of_workers=1, executor_type='thread',
+                              analysis_class=PandasBasedEnrichmentAnalysis, maximum_pending_analyses=None):
+    '''
+    Resumable enrichment analysis of many lists of interest against a shared reference.
+        -reference: an EnrichmentReference created from a snapshot or the path of a snapshot
+         (a path is needed with executor_type = 'process', each process maps the snapshot once).
+        -manifest: dictionary with the name of the list as key and the list of its genes as value
+         (it can be created with manifest_creation).
+        -output_directory: the results of the list are written in results_<list name>_over.tsv.
+        -path_journal: the SQLite journal of the batch, by default journal.sqlite in output_directory.
+        -number_of_workers, executor_type: the analyses are run in a pool of threads or processes,
+         at most maximum_pending_analyses (by default twice the number of workers) are submitted at the same time.
+    Each finished analysis is recorded in the journal with the hash of its input and the path of its result.
+    When the batch is run again (for example after a crash), the lists with the same input and an existing result are skipped.
+    Return a dictionary with the name of the list as key and its status ('done', 'skipped' or 'failed') as value.
+    '''
+    if executor_type not in ['thread', 'process']:
+        raise ValueError("The executor type must be 'thread' or 'process'.")
+    if executor_type == 'process' and not isinstance(reference, str):
+        raise ValueError("The path of a snapshot is needed to share the reference with processes.")
+
+    logger.info('-------------------------------------Batch Enrichment Analysis-------------------------------------')
+
+    os.makedirs(output_directory, exist_ok=True)
+    if path_journal is None:
+        path_journal = os.path.join(output_directory, 'journal.sqlite')
+    if maximum_pending_analyses is None:
+        maximum_pending_analyses = 2 * number_of_workers
+
+    parameters = {'alpha': alpha, 'threshold_normal_approximation': threshold_normal_approximation,
+                  'analysis_class': analysis_class.__module__ + '.' + analysis_class.__name__,
+                  'reference': reference_fingerprint(_opening_reference(reference))}
+
+    analysis_status = {}
+
+    with BatchJournal(path_journal) as journal:
+        pending_analyses = []
+        for list_name, interest_genes in manifest.items():
+            input_hash = interest_list_hash(interest_genes, parameters)
+            if journal.is_finished(list_name, input_hash):
+                analysis_status[list_name] = 'skipped'
+            else:
+                output_path = os.path.join(output_directory, 'results_' + str(list_name) + '_over.tsv')
+                pending_analyses.append((list_name, interest_genes, input_hash, output_path))
+
+        logger.info('%s analyses skipped, %s analyses to run', len(analysis_status), len(pending_analyses))
+
+        executor_class = ProcessPoolExecutor if executor_type == 'process' else ThreadPoolExecutor
+        pending_analyses = iter(pending_analyses)
+        running_analyses = {}
+
+        with executor_class(max_workers=number_of_workers) as executor:
+            while True:
+                for list_name, interest_genes, input_hash, output_path in pending_analyses:
+                    future = executor.submit(_running_batch_analysis, reference, interest_genes, output_path,
+                                             alpha, threshold_normal_approximation, analysis_class)
+                    running_analyses[future] = (list_name, input_hash, output_path)
+                    if len(running_analyses) >= maximum_pending_analyses:
+                        break
+
+                if running_analyses == {}:
+                    break
+
+                finished_futures, _ = wait(running_analyses, return_when=FIRST_COMPLETED)
+                for future in finished_futures:
+                    list_name, input_hash, output_path = running_analyses.pop(future)
+                    try:
+                        number_of_genes_found = future.result()
+                    except Exception as error:
+                        logger.error('Analysis of %s failed: %s', list_name, error)
+                        journal.recording_analysis(list_name, input_hash, output_path, 'failed', message=repr(error))
+                        analysis_status[list_name] = 'failed'
+                    else:
+                        journal.recording_analysis(list_name, input_hash, output_path, 'done',
+                                                   number_of_genes_found=number_of_genes_found)
+                        analysis_status[list_name] = 'done'
+
+    return analysis_status
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import logging
+import numpy as np
+import pandas as pa
+import scipy.sparse as sparse
+
+from scipy.sparse.csgraph import connected_components
+
+from pbsea.preprocessing import incidence_matrix_creation
+
+logger = logging.getLogger(__name__)
+
+
+def kappa_similarity(incidence_matrix, number_of_genes_in_reference):
+    '''
+    Compute the Cohen's kappa similarity between each pair of objects (rows of the incidence matrix).
+    The number of shared genes is computed with a sparse product of the incidence matrix
+    by its transpose, so only the pairs of objects sharing at least one gene are computed
+    (the other pairs have a kappa lower or equal to 0 and can not be clustered together).
+    Return a sparse matrix containing the kappa of the pairs sharing genes (diagonal excluded).
+    '''
+    incidence_matrix = sparse.csr_matrix(incidence_matrix, dtype=np.int64)
+    object_sizes = np.asarray(incidence_matrix.sum(axis=1)).ravel().astype(float)
+
+    shared_genes = (incidence_matrix @ incidence_matrix.T).tocoo()
+    not_diagonal = shared_genes.row != shared_genes.col
+    rows = shared_genes.row[not_diagonal]
+    columns = shared_genes.col[not_diagonal]
+    both = shared_genes.data[not_diagonal].astype(float)
+
+    total = float(number_of_genes_in_reference)
+    size_rows = object_sizes[rows]
+    size_columns = object_sizes[columns]
+
+    neither = total - size_rows - size_columns + both
+    observed_agreement = (both + neither) / total
+    chance_agreement = (size_rows * size_columns + (total - size_rows) * (total - size_columns)) / (total * total)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappas = np.where(chance_agreement < 1, (observed_agreement - chance_agreement) / (1 - chance_agreement), 0)
+
+    return sparse.csr_matrix((kappas, (rows, columns)), shape=shared_genes.shape)
+
+def functional_annotation_clustering(df, gene_sets, number_of_genes_in_reference, pvalue_column='pvalue_hypergeometric',
+                                     kappa_threshold=0.35, initial_group_membership=3, multiple_linkage_threshold=0.5):
+    '''
+    Group redundant significant objects (e.g. GO terms) in the style of DAVID functional annotation clustering
+    (Huang et al. 2007, Genome Biology 8:R183).
+    The input dataframe contains the significant objects in index and their pvalue in pvalue_column.
+    gene_sets is a dictionary (object as key and set of genes as value),
+    it can be created with gene_sets_dictionary_creation.
+        -kappa_threshold: minimal kappa for two objects to be linked.
+        -initial_group_membership: minimal number of objects in a seed group.
+        -multiple_linkage_threshold: minimal percentage of linked pairs in a seed group
+         and minimal percentage of shared objects to merge two groups.
+    Return a dataframe with the objects in index, the number of their cluster and the enrichment score
+    of the cluster (geometric mean of the pvalues in -log10 scale). An object can belong to several clusters.
+    '''
+    logger.info('-------------------------------------Functional annotation clustering-------------------------------------')
+
+    analyzed_objects = [analyzed_object for analyzed_object in df.index if analyzed_object in gene_sets]
+    incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(gene_sets, analyzed_objects)
+
+    kappas = kappa_similarity(incidence_matrix, number_of_genes_in_reference)
+    linked_objects = (kappas >= kappa_threshold).astype(np.int64).tocsr()
+    linked_objects.eliminate_zeros()
+
+    seed_groups = []
+    for object_index in range(len(analyzed_objects)):
+        neighbours = linked_objects.indices[linked_objects.indptr[object_index]:linked_objects.indptr[object_index + 1]]
+        group = np.union1d(neighbours, [object_index])
+        if len(group) < initial_group_membership:
+            continue
+        number_of_linked_pairs = linked_objects[group][:, group].nnz
+        if number_of_linked_pairs / (len(group) * (len(group) - 1)) >= multiple_linkage_threshold:
+            seed_groups.append(group)
+
+    logger.debug('Number of seed groups: %s', len(seed_groups))
+
+    columns = ['Cluster', 'EnrichmentScore', pvalue_column]
+    if seed_groups == []:
+        return pa.DataFrame(columns=columns)
+
+    groups = seed_groups
+    while True:
+        memberships = sparse.csr_matrix((np.ones(sum(len(group) for group in groups), dtype=np.int64),
+                                        (np.repeat(np.arange(len(groups)), [len(group) for group in groups]), np.concatenate(groups))),
+                                        shape=(len(groups), len(analyzed_objects)))
+        group_sizes = np.array([len(group) for group in groups], dtype=float)
+
+        shared_objects = (memberships @ memberships.T).tocoo()
+        smallest_sizes = np.minimum(group_sizes[shared_objects.row], group_sizes[shared_objects.col])
+        to_merge = shared_objects.data / smallest_sizes >= multiple_linkage_threshold
+        merging_graph = sparse.csr_matrix((np.ones(to_merge.sum()), (shared_objects.row[to_merge], shared_objects.col[to_merge])),
+                                        shape=shared_objects.shape)
+
+        group_labels = connected_components(merging_graph, directed=False)[1]
+        merged_groups = {}
+        for group, label in zip(groups, group_labels):
+            merged_groups.setdefault(label, set()).update(group)
+        merged_groups = sorted({tuple(sorted(group)) for group in merged_groups.values()})
+
+        number_of_groups = len(groups)
+        groups = [np.array(group) for group in merged_groups]
+        if len(groups) == number_of_groups:
+            break
+
+    pvalues = df.loc[analyzed_objects, pvalue_column].values.astype(float)
+    log_pvalues = -np.log10(np.maximum(pvalues, np.finfo(float).tiny))
+    enrichment_scores = [log_pvalues[group].mean() for group in groups]
+
+    clustered_objects = []
+    rows = []
+    for cluster_number, group_index in enumerate(np.argsort(enrichment_scores, kind='mergesort')[::-1]):
+        group = groups[group_index]
+        for object_index in group[np.argsort(pvalues[group], kind='mergesort')]:
+            clustered_objects.append(analyzed_objects[object_index])
+            rows.append((cluster_number + 1, enrichment_scores[group_index], pvalues[object_index]))
+
+    df_clusters = pa.DataFrame(rows, columns=columns, index=pa.Index(clustered_objects, name=df.index.name))
+
+    logger.debug('Functional annotation clustering dataframe: %s', df_clusters)
+
+    return df_clusters
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LazyEnrichmentResult():
+    '''
+    Result of an enrichment analysis where only the tests are computed at the creation.
+    The adjusted pvalues of a multiple test and its significative objects are computed
+    the first time they are accessed and memoized, so the unused corrections cost nothing.
+    It is created by the compute_lazy_enrichment method of the analysis classes:
+        -adjusted_pvalues(multiple_test_name): the column 'pValue' + multiple_test_name.
+        -significative_objects(multiple_test_name): the list of significative objects.
+        -dataframe: the result dataframe with the corrections computed until now.
+        -results(multiple_test_names): the result dataframe and the dictionary of significative objects
+         (like compute_enrichment) for these multiple tests (by default all the multiple_test_names).
+    '''
+    def __init__(self, analysis):
+        self._analysis = analysis
+
+        dataframe, self._object_representatives = analysis.compute_tests()
+        self._dataframe = dataframe.sort_values([analysis.statistic_method])
+
+        self._correction_functions = analysis.correction_functions()
+        self._computed_corrections = set()
+        self._significative_objects = {}
+
+    @property
+    def multiple_test_names(self):
+        return list(self._analysis.multiple_test_names)
+
+    def computing_correction(self, multiple_test_name):
+        if multiple_test_name not in self._analysis.multiple_test_names:
+            raise ValueError("Unknown multiple test: " + multiple_test_name + ".")
+
+        if multiple_test_name in self._correction_functions and multiple_test_name not in self._computed_corrections:
+            logger.debug('Lazy computation of the %s correction', multiple_test_name)
+            self._analysis.check_cancellation()
+            self._dataframe = self._correction_functions[multiple_test_name](self._dataframe)
+            self._computed_corrections.add(multiple_test_name)
+
+    def adjusted_pvalues(self, multiple_test_name):
+        if multiple_test_name in self._analysis.multiple_test_names and multiple_test_name not in self._correction_functions:
+            raise ValueError(multiple_test_name + " has no adjusted pvalues, it adjusts the error rate.")
+
+        self.computing_correction(multiple_test_name)
+
+        return self.dataframe['pValue' + multiple_test_name]
+
+    def significative_objects(self, multiple_test_name):
+        if multiple_test_name not in self._significative_objects:
+            self.computing_correction(multiple_test_name)
+            object_significatives = self._analysis.selection_object(multiple_test_name, self._dataframe)
+
+            if self._object_representatives is not None:
+                object_significatives = self._analysis.expanding_significative_objects({multiple_test_name: object_significatives},
+                                                                                       self._object_representatives)[multiple_test_name]
+            self._significative_objects[multiple_test_name] = object_significatives
+
+        return self._significative_objects[multiple_test_name]
+
+    @property
+    def dataframe(self):
+        df = self._analysis.annotating_dataframe(self._dataframe.copy())
+
+        if self._object_representatives is not None:
+            df = self._analysis.expanding_identical_objects(df, self._object_representatives)
+
+        return df
+
+    def results(self, multiple_test_names=None):
+        if multiple_test_names is None:
+            multiple_test_names = self.multiple_test_names
+
+        significative_objects = {multiple_test_name: self.significative_objects(multiple_test_name)
+                                 for multiple_test_name in multiple_test_names}
+
+        return self.dataframe, significative_objects
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import logging
+import pandas as pa
+
+from pbsea.pbsea import PandasBasedEnrichmentAnalysis
+from pbsea.preprocessing import counting_objects_multiple_namespaces
+
+logger = logging.getLogger(__name__)
+
+
+def multiple_namespaces_enrichment_analysis(index_column, objects_to_analyze, name_path_file_interest, name_path_file_reference,
+                                            number_of_object_of_interest, number_of_genes_in_reference, alpha,
+                                            threshold_normal_approximation, correction_scope='namespace',
+                                            analysis_class=PandasBasedEnrichmentAnalysis):
+    '''
+    Enrichment analysis of several namespaces (e.g. GOs, ECs and InterPros columns of the same annotation file)
+    with one reading of the files.
+    The results of all the namespaces are returned in one dataframe with a Namespace column.
+        -correction_scope: 'namespace' to apply the multiple testing corrections in each namespace,
+         'global' to apply them on the tests of all the namespaces together.
+    Return the combined dataframe and a dictionary with the namespace as key and the dictionary
+    of significative objects of the namespace as value.
+    '''
+    if correction_scope not in ['namespace', 'global']:
+        raise ValueError("The correction scope must be 'namespace' or 'global'.")
+
+    logger.info('-------------------------------------Multiple namespaces Enrichment Analysis-------------------------------------')
+
+    counts_by_namespace = counting_objects_multiple_namespaces(index_column, objects_to_analyze,
+                                                               name_path_file_interest, name_path_file_reference)
+
+    namespace_dataframes = []
+    for object_to_analyze in objects_to_analyze:
+        df_int, df_ref = counts_by_namespace[object_to_analyze]
+        df = df_int.join(df_ref)
+        df.index.name = 'AnalyzedObject'
+        df['Namespace'] = object_to_analyze
+        namespace_dataframes.append(df)
+
+    significative_objects_by_namespace = {}
+
+    if correction_scope == 'namespace':
+        result_dataframes = []
+        for object_to_analyze, df in zip(objects_to_analyze, namespace_dataframes):
+            analysis = analysis_class(df, 'count_int', 'count_ref', number_of_object_of_interest,
+                                      number_of_genes_in_reference, alpha, threshold_normal_approximation)
+            df_result, significative_objects = analysis.compute_enrichment()
+            result_dataframes.append(df_result)
+            significative_objects_by_namespace[object_to_analyze] = significative_objects
+
+        df_results = pa.concat(result_dataframes)
+
+    elif correction_scope == 'global':
+        df = pa.concat(namespace_dataframes)
+        if df.index.has_duplicates:
+            raise ValueError("Some objects are in several namespaces, the correction can not be global.")
+
+        analysis = analysis_class(df, 'count_int', 'count_ref', number_of_object_of_interest,
+                                  number_of_genes_in_reference, alpha, threshold_normal_approximation)
+        df_results, significative_objects = analysis.compute_enrichment()
+
+        object_namespaces = df_results['Namespace']
+        for object_to_analyze in objects_to_analyze:
+            significative_objects_by_namespace[object_to_analyze] = {multiple_test_name: [analyzed_object for analyzed_object in object_significatives
+                                                                                          if object_namespaces[analyzed_object] == object_to_analyze]
+                                                                     for multiple_test_name, object_significatives in significative_objects.items()}
+
+    logger.debug('Multiple namespaces dataframe: %s', df_results)
+
+    return df_results, significative_objects_by_namespace
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import collections
 import logging
 import csv
 import math
@@ -9,12 +10,21 @@ import pandas as pa
 import scipy.stats as stats
 import six
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pbsea.lazy import LazyEnrichmentResult
 from statsmodels.sandbox.stats.multicomp import multipletests
 
 logging.basicConfig(filename='analysis.log', level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+class AnalysisCancelled(Exception):
+    '''
+    Raised when the cancellation event of an analysis is set, between two chunks of work.
+    '''
+    pass
+
+
 class PandasBasedEnrichmentAnalysis():
 
     '''
@@ -32,6 +42,23 @@ class PandasBasedEnrichmentAnalysis():
             -alpha : the alpha threshold also known as type I error.
             -normal approximation threshold : the threshold separating the hypergeometric test
              (which runs very slowly when using big numbers) and normal approximation.
+        The pvalues can be computed on several cores (with set number_of_workers), the dataframe
+        is then split in chunks of chunk_size objects, computed in a process pool (or a thread pool
+        with executor_type = 'thread') and merged before the multiple testing corrections.
+        The hypergeometric test holds the GIL, so a thread pool only speeds up the normal approximation
+        (use the default process pool for the hypergeometric test).
+        With set tarone_pruning = True, the objects which can not be significant (their minimum achievable
+        pvalue is too high) are removed before the tests using the procedure of Tarone (Biometrics 46:515, 1990).
+        Long analyses can report their progress to a progress_callback (called with the stage: 'test', 'correction'
+        or 'writing', the work done and the total work) and can be stopped with a cancellation_event
+        (for example a threading.Event), checked between chunks: AnalysisCancelled is then raised
+        and no result file is left.
+        With identical_objects (a dictionary with the object as key and the representative of its gene set as value,
+        created by identical_gene_sets_grouping), the objects annotating the same genes are tested once and their
+        results are copied to all the objects of the set. By default the corrections count all the objects,
+        with correction_on_unique_gene_sets = True they count each unique gene set once.
+        With required_multiple_tests (a list of multiple_test_names), only these corrections and selections
+        are computed. compute_lazy_enrichment returns a LazyEnrichmentResult computing them on first access.
     '''
 
     def __init__(self, dataframe, name_column_interest, name_column_reference,
@@ -49,6 +76,17 @@ class PandasBasedEnrichmentAnalysis():
         self._alpha = alpha
         self._normal_approximation_threshold = threshold_normal_approximation
         self._statistic_method = ""
+        self._number_of_workers = 1
+        self._chunk_size = 10000
+        self._executor_type = 'process'
+        self._tarone_pruning = False
+        self._number_of_pruned_objects = 0
+        self._progress_callback = None
+        self._cancellation_event = None
+        self._identical_objects = None
+        self._correction_on_unique_gene_sets = False
+        self._number_of_collapsed_objects = 0
+        self._required_multiple_tests = None
         self.multiple_test_names = ['Sidak', 'Bonferroni', 'Holm', 'BenjaminiHochberg', 'BenjaminiYekutieli']
 
     @property
@@ -121,29 +159,260 @@ class PandasBasedEnrichmentAnalysis():
     def normal_approximation_threshold(self, value):
         self._normal_approximation_threshold = value
 
+    @property
+    def number_of_workers(self):
+        return self._number_of_workers
+
+    @number_of_workers.setter
+    def number_of_workers(self, value):
+        if value < 1:
+            raise ValueError("The number of workers must be at least 1.")
+        else:
+            self._number_of_workers = value
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        if value < 1:
+            raise ValueError("The size of the chunks must be at least 1.")
+        else:
+            self._chunk_size = value
+
+    @property
+    def executor_type(self):
+        return self._executor_type
+
+    @executor_type.setter
+    def executor_type(self, value):
+        if value not in ['process', 'thread']:
+            raise ValueError("The executor type must be 'process' or 'thread'.")
+        else:
+            self._executor_type = value
+
+    @property
+    def tarone_pruning(self):
+        return self._tarone_pruning
+
+    @tarone_pruning.setter
+    def tarone_pruning(self, value):
+        self._tarone_pruning = value
+
+    @property
+    def number_of_pruned_objects(self):
+        return self._number_of_pruned_objects
+
+    @property
+    def progress_callback(self):
+        return self._progress_callback
+
+    @progress_callback.setter
+    def progress_callback(self, callback):
+        self._progress_callback = callback
+
+    @property
+    def cancellation_event(self):
+        return self._cancellation_event
+
+    @cancellation_event.setter
+    def cancellation_event(self, event):
+        self._cancellation_event = event
+
+    @property
+    def required_multiple_tests(self):
+        return self._required_multiple_tests
+
+    @required_multiple_tests.setter
+    def required_multiple_tests(self, multiple_test_names):
+        if multiple_test_names is not None:
+            unknown_multiple_tests = [multiple_test_name for multiple_test_name in multiple_test_names
+                                      if multiple_test_name not in self.multiple_test_names]
+            if unknown_multiple_tests != []:
+                raise ValueError("Unknown multiple tests: " + ", ".join(unknown_multiple_tests) + ".")
+            multiple_test_names = list(multiple_test_names)
+        self._required_multiple_tests = multiple_test_names
+
+    @property
+    def identical_objects(self):
+        return self._identical_objects
+
+    @identical_objects.setter
+    def identical_objects(self, object_representatives):
+        self._identical_objects = object_representatives
+
+    @property
+    def correction_on_unique_gene_sets(self):
+        return self._correction_on_unique_gene_sets
+
+    @correction_on_unique_gene_sets.setter
+    def correction_on_unique_gene_sets(self, value):
+        self._correction_on_unique_gene_sets = value
+
+    @property
+    def number_of_collapsed_objects(self):
+        return self._number_of_collapsed_objects
+
+    def report_progress(self, stage, work_done, total_work):
+        if self.progress_callback is not None:
+            self.progress_callback(stage, work_done, total_work)
+
+    def check_cancellation(self):
+        if self.cancellation_event is not None and self.cancellation_event.is_set():
+            logger.info('Analysis cancelled')
+            raise AnalysisCancelled("The analysis has been cancelled.")
+
+    def minimum_achievable_pvalues(self, df):
+        '''
+        Compute the lowest pvalue that each object can reach with the hypergeometric test,
+        when all the objects of interest are annotated by it (or all its objects in reference are in the interest).
+        '''
+        reference_counts = df[self.column_reference].values
+        maximum_interest_counts = np.minimum(reference_counts, self.number_of_analyzed_object_of_interest)
+
+        return stats.hypergeom.sf(maximum_interest_counts - 1, self.number_of_analyzed_object_of_reference,
+                                  reference_counts, self.number_of_analyzed_object_of_interest)
+
+    def pruning_untestable_objects(self, df):
+        '''
+        Remove the untestable objects with the procedure of Tarone: find the smallest number of tests k
+        such as the number of objects with a minimum achievable pvalue lower or equal to alpha / k is at most k,
+        and keep only these objects. The corrections are then computed on the testable objects only.
+        '''
+        minimum_pvalues = self.minimum_achievable_pvalues(df)
+        sorted_minimum_pvalues = np.sort(minimum_pvalues)
+
+        numbers_of_tests = np.arange(1, len(df.index) + 1)
+        numbers_of_testable_objects = np.searchsorted(sorted_minimum_pvalues, self.alpha / numbers_of_tests, side='right')
+        number_of_tests = numbers_of_tests[np.argmax(numbers_of_testable_objects <= numbers_of_tests)] if len(df.index) > 0 else 1
+
+        testable_objects = minimum_pvalues <= self.alpha / number_of_tests
+        self._number_of_pruned_objects = int((~testable_objects).sum())
+
+        logger.info('Tarone pruning: %s objects pruned, %s testable objects', self.number_of_pruned_objects, testable_objects.sum())
+
+        return df[testable_objects]
+
+    def collapsing_identical_objects(self, df):
+        '''
+        Keep one object (the first one in the dataframe) for each gene set of identical_objects.
+        The counts are part of the key, so objects with the same gene set but different counts are never merged.
+        Return the dataframe of the unique gene sets and a series with the objects in index
+        and the object representing them in the collapsed dataframe as value.
+        '''
+        gene_set_keys = zip([self.identical_objects.get(analyzed_object, analyzed_object) for analyzed_object in df.index],
+                            df[self.column_interest].values, df[self.column_reference].values)
+
+        representatives = {}
+        object_representatives = pa.Series([representatives.setdefault(gene_set_key, analyzed_object)
+                                            for gene_set_key, analyzed_object in zip(gene_set_keys, df.index)], index=df.index)
+        unique_objects = object_representatives.index == object_representatives.values
+
+        self._number_of_collapsed_objects = int((~unique_objects).sum())
+        logger.info('%s objects collapsed in %s unique gene sets', self.number_of_collapsed_objects, unique_objects.sum())
+
+        return df[unique_objects], object_representatives
+
+    def expanding_identical_objects(self, df, object_representatives):
+        '''
+        Copy the results of each representative to all the objects of its gene set,
+        the objects stay sorted by pvalue.
+        '''
+        object_representatives = object_representatives[object_representatives.isin(df.index)]
+
+        df_expanded = df.loc[object_representatives.values]
+        df_expanded.index = pa.Index(object_representatives.index, name=df.index.name)
+        df_expanded['IdenticalGeneSet'] = object_representatives.values
+        df_expanded = df_expanded.iloc[np.argsort(df.index.get_indexer(object_representatives.values), kind='mergesort')]
+
+        return df_expanded
+
+    def expanding_significative_objects(self, significative_objects, object_representatives):
+        objects_of_representatives = object_representatives.groupby(object_representatives.values).groups
+
+        return {multiple_test_name: [analyzed_object for representative in object_significatives
+                                     for analyzed_object in objects_of_representatives.get(representative, [representative])]
+                for multiple_test_name, object_significatives in significative_objects.items()}
+
     def test_on_dataframe(self, df):
         analyzed_objects_with_hypergeo_test_nan = []
 
         approximation_threshold = self.normal_approximation_threshold
 
-        value_higher_threshold = all(df[self.column_interest] > approximation_threshold)
+        # An empty dataframe (e.g. all the objects pruned) keeps the hypergeometric test.
+        value_higher_threshold = len(df.index) > 0 and all(df[self.column_interest] > approximation_threshold)
 
         if value_higher_threshold == False:
             self.statistic_method = "pvalue_hypergeometric"
 
-            df[self.statistic_method] = df.apply(self.compute_hypergeometric_test,
-                                                 axis=1)
+            if self.number_of_workers > 1:
+                df[self.statistic_method] = self.compute_pvalues_in_chunks(df)
+            else:
+                df[self.statistic_method] = self.apply_in_chunks(df, self.compute_hypergeometric_test)
             df = df.sort_values(self.statistic_method)
 
         elif value_higher_threshold == True:
             self.output_columns[4] = 'pvalue_normal_approximation'
             self.statistic_method = 'pvalue_normal_approximation'
-            df[self.statistic_method] = df.apply(self.compute_normal_approximation,
-                                                 axis=1)
+            if self.number_of_workers > 1:
+                df[self.statistic_method] = self.compute_pvalues_in_chunks(df)
+            else:
+                df[self.statistic_method] = self.apply_in_chunks(df, self.compute_normal_approximation)
             df = df.sort_values(self.statistic_method)
 
         return df
 
+    def apply_in_chunks(self, df, test_function):
+        '''
+        Apply the test function on each row of the dataframe, chunk by chunk, to report the progress
+        and check the cancellation between two chunks.
+        '''
+        number_of_objects = len(df.index)
+        pvalue_chunks = []
+
+        for chunk_start in range(0, number_of_objects, self.chunk_size):
+            self.check_cancellation()
+            df_chunk = df.iloc[chunk_start:chunk_start + self.chunk_size]
+            pvalue_chunks.append(df_chunk.apply(test_function, axis=1))
+            self.report_progress('test', min(chunk_start + self.chunk_size, number_of_objects), number_of_objects)
+
+        return pa.concat(pvalue_chunks) if pvalue_chunks != [] else pa.Series([], index=df.index, dtype=float)
+
+    def compute_pvalues_in_chunks(self, df):
+        '''
+        Compute the pvalues of the statistic method on chunks of the dataframe in a pool of workers.
+        Chunks are computed with the same formulas as compute_hypergeometric_test and compute_normal_approximation
+        (vectorized on the chunk) and merged in the order of the dataframe, so the result is identical to the serial one.
+        '''
+        number_of_objects = len(df.index)
+        interest_counts = df[self.column_interest].values
+        reference_counts = df[self.column_reference].values
+        chunk_starts = range(0, number_of_objects, self.chunk_size)
+
+        executor_class = ProcessPoolExecutor if self.executor_type == 'process' else ThreadPoolExecutor
+        with executor_class(max_workers=self.number_of_workers) as executor:
+            futures = [executor.submit(_compute_pvalues_chunk, self.statistic_method,
+                                       interest_counts[chunk_start:chunk_start + self.chunk_size],
+                                       reference_counts[chunk_start:chunk_start + self.chunk_size],
+                                       self.number_of_analyzed_object_of_interest, self.number_of_analyzed_object_of_reference)
+                       for chunk_start in chunk_starts]
+
+            pvalues = []
+            try:
+                for chunk_start, future in zip(chunk_starts, futures):
+                    self.check_cancellation()
+                    pvalues.append(future.result())
+                    self.report_progress('test', min(chunk_start + self.chunk_size, number_of_objects), number_of_objects)
+            except AnalysisCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        logger.debug('Pvalues computed in %s chunks with %s %s workers', len(pvalues), self.number_of_workers, self.executor_type)
+
+        return pa.Series(np.concatenate(pvalues) if pvalues != [] else [], index=df.index, dtype=float)
+
     def compute_hypergeometric_test(self, row):
         number_of_object_in_interest = row[self.column_interest]
         number_of_object_in_reference = row[self.column_reference]
@@ -173,73 +442,141 @@ class PandasBasedEnrichmentAnalysis():
         return pvalue_normal
 
     def multiple_testing_correction(self, df):
+        '''
+        Compute the corrections and the significative objects of the multiple tests
+        of required_multiple_tests (all the multiple_test_names by default).
+        '''
         logger.info('-------------------------------------Multiple testing correction-------------------------------------')
         df = df.sort_values([self.statistic_method])
 
-        df = self.correction_bonferroni(df)
-        df = self.correction_benjamini_hochberg(df)
-        df = self.correction_benjamini_yekutieli(df)
-        df = self.correction_holm(df)
+        multiple_test_names = self.selected_multiple_test_names()
+        correction_functions = self.correction_functions()
+
+        df = self.apply_corrections(df, [correction_function for multiple_test_name, correction_function in correction_functions.items()
+                                         if multiple_test_name in multiple_test_names])
 
         significative_objects = {}
 
-        for multiple_test_name in self.multiple_test_names:
-            if multiple_test_name == 'Sidak':
-                error_rate = self.error_rate_adjustement_sidak(df)
-            elif multiple_test_name == 'Bonferroni':
-                error_rate = self.error_rate_adjustement_bonferroni(df)
-            if multiple_test_name in ['Sidak', 'Bonferroni']:
-                object_significatives = self.selection_object_with_adjusted_error_rate(error_rate, df)
-            elif multiple_test_name in ['Holm', 'BenjaminiHochberg', 'BenjaminiYekutieli']:
-                object_significatives = self.selection_object_with_adjusted_pvalue(multiple_test_name, df)
+        for multiple_test_name in multiple_test_names:
+            significative_objects[multiple_test_name] = self.selection_object(multiple_test_name, df)
 
-            significative_objects[multiple_test_name] = object_significatives
+        df = self.annotating_dataframe(df)
 
         logger.debug('Multiple testing correction dataframe: %s', df)
 
         return df, significative_objects
 
+    def selected_multiple_test_names(self):
+        return [multiple_test_name for multiple_test_name in self.multiple_test_names
+                if self.required_multiple_tests is None or multiple_test_name in self.required_multiple_tests]
+
+    def correction_functions(self):
+        '''
+        Return an ordered dictionary with the name of the multiple test as key and the function adding
+        its adjusted pvalues (column 'pValue' + name) as value. Sidak only needs the pvalues.
+        '''
+        return collections.OrderedDict([('Bonferroni', self.correction_bonferroni),
+                                        ('BenjaminiHochberg', self.correction_benjamini_hochberg),
+                                        ('BenjaminiYekutieli', self.correction_benjamini_yekutieli),
+                                        ('Holm', self.correction_holm)])
+
+    def selection_object(self, multiple_test_name, df):
+        if multiple_test_name == 'Sidak':
+            return self.selection_object_with_adjusted_error_rate(self.error_rate_adjustement_sidak(df), df)
+        elif multiple_test_name == 'Bonferroni':
+            return self.selection_object_with_adjusted_error_rate(self.error_rate_adjustement_bonferroni(df), df)
+        else:
+            return self.selection_object_with_adjusted_pvalue(multiple_test_name, df)
+
+    def annotating_dataframe(self, df):
+        return df
+
+    def apply_corrections(self, df, correction_functions):
+        '''
+        Apply the multiple testing corrections one after the other, reporting the progress
+        and checking the cancellation between two corrections.
+        '''
+        for correction_number, correction_function in enumerate(correction_functions):
+            self.check_cancellation()
+            df = correction_function(df)
+            self.report_progress('correction', correction_number + 1, len(correction_functions))
+
+        return df
+
+    def writing_dataframe(self, df, output_file):
+        '''
+        Write the dataframe in the output file by chunks of rows, reporting the progress
+        and checking the cancellation between two chunks.
+        '''
+        number_of_rows = len(df.index)
+
+        for chunk_start in range(0, max(number_of_rows, 1), self.chunk_size):
+            self.check_cancellation()
+            df.iloc[chunk_start:chunk_start + self.chunk_size].to_csv(output_file, sep="\t", float_format='%.6f', index=True,
+                                                                     header=(chunk_start == 0), quoting=csv.QUOTE_NONE)
+            self.report_progress('writing', min(chunk_start + self.chunk_size, number_of_rows), number_of_rows)
+
+    def writing_output_files(self, df, significative_objects, output_paths):
+        '''
+        The results are written in temporary files (by writing_results), renamed when all the files are written
+        or removed if the analysis is cancelled, so no half-written result file is left.
+        '''
+        try:
+            self.writing_results(df, significative_objects, output_paths)
+        except AnalysisCancelled:
+            for output_path in output_paths:
+                if os.path.exists(output_path + '.tmp'):
+                    os.remove(output_path + '.tmp')
+            raise
+
+        for output_path in output_paths:
+            os.replace(output_path + '.tmp', output_path)
+
     def writing_output(self, df, significative_objects):
         '''
         For the second results file (file with significative objects):
-        Results are written using sorted(dictionnary), so the list of result corresponds to : 
-        Sidak (position 4 in the list), Bonferroni (position 2),
-        Holm (position 3), Benjamini & Hochberg (position 0) and Benjamini & Yekutieli (position 1).
+        Results are written in one column for each multiple test, in the order of multiple_test_names.
         '''
         logger.info('-------------------------------------Write output-------------------------------------')
 
-        df.sort_values(['pValueBenjaminiHochberg'], inplace=True)
+        df.sort_values([self.sorting_column_output(df)], inplace=True)
 
-        comment_file = open("results_annotation_over.tsv", "w")
-        comment_file.write("# Number of objects in reference : " + str(self.number_of_analyzed_object_of_reference) +
-                                        "\t Number of objects in interest : " + str(self.number_of_analyzed_object_of_interest) +"\n")
-        df.to_csv(comment_file, sep="\t", float_format='%.6f', index=True, header=True, quoting=csv.QUOTE_NONE)
+        output_paths = ["results_annotation_over.tsv", "results_significatives_over.tsv"]
 
-        comment_file.close()
+        self.writing_output_files(df, significative_objects, output_paths)
 
-        csvfile = open("results_significatives_over.tsv", "w", newline="")
+    def sorting_column_output(self, df):
+        return 'pValueBenjaminiHochberg' if 'pValueBenjaminiHochberg' in df.columns else self.statistic_method
 
-        writer = csv.writer(csvfile, delimiter="\t")
-        writer.writerow(['Sidak', 'Bonferroni', 'Holm', 'BenjaminiHochberg', 'BenjaminiYekutieli'])
+    def significative_objects_header(self, multiple_test_names):
+        return multiple_test_names
 
-        number_significatives_per_method = {}
+    def writing_results(self, df, significative_objects, output_paths):
+        with open(output_paths[0] + '.tmp', "w") as comment_file:
+            comment_file.write("# Number of objects in reference : " + str(self.number_of_analyzed_object_of_reference) +
+                                            "\t Number of objects in interest : " + str(self.number_of_analyzed_object_of_interest) +
+                                            ("\t Number of pruned objects : " + str(self.number_of_pruned_objects) if self.tarone_pruning else "") + "\n")
+            self.writing_dataframe(df, comment_file)
 
-        for method in significative_objects:
-            number_significatives_per_method[method] = len(significative_objects[method])
+        multiple_test_names = [multiple_test_name for multiple_test_name in self.multiple_test_names if multiple_test_name in significative_objects]
 
-        max_significatives_method = max(number_significatives_per_method, key = number_significatives_per_method.get)
+        csvfile = open(output_paths[1] + '.tmp', "w", newline="")
 
-        for index in range(len(significative_objects[max_significatives_method])):
+        writer = csv.writer(csvfile, delimiter="\t")
+        writer.writerow(self.significative_objects_header(multiple_test_names))
+
+        max_number_significatives = max([len(significative_objects[multiple_test_name]) for multiple_test_name in multiple_test_names], default=0)
+
+        for index in range(max_number_significatives):
             results = []
-            for method in sorted(significative_objects):
-                if index in range(len(significative_objects[method])):
-                    object_significatives_value = significative_objects[method][index]
+            for multiple_test_name in multiple_test_names:
+                if index < len(significative_objects[multiple_test_name]):
+                    object_significatives_value = significative_objects[multiple_test_name][index]
                 else:
                     object_significatives_value = 'nonsignificant'
                 results.append(object_significatives_value)
 
-            writer.writerow([results[4], results[2], results[3],
-                             results[0], results[1]])
+            writer.writerow(results)
 
         csvfile.close()
 
@@ -265,9 +602,13 @@ class PandasBasedEnrichmentAnalysis():
         return df
 
     def correction_benjamini_yekutieli(self, df):
-        df.sort_values(by='pvalue_hypergeometric', ascending=True, inplace=True)
+        df.sort_values(by=self.statistic_method, ascending=True, inplace=True)
 
-        df['pValueBenjaminiYekutieli'] = multipletests(df['pvalue_hypergeometric'].tolist(), alpha=0.05, method="fdr_by")[1]
+        if len(df.index) == 0:
+            df['pValueBenjaminiYekutieli'] = []
+            return df
+
+        df['pValueBenjaminiYekutieli'] = multipletests(df[self.statistic_method].tolist(), alpha=0.05, method="fdr_by")[1]
 
         return df
 
@@ -277,6 +618,10 @@ class PandasBasedEnrichmentAnalysis():
         number_of_test = len(df.index)
         pvalue_max = 0
 
+        if number_of_test == 0:
+            df['pValueHolm'] = []
+            return df
+
         for analyzed_object, row in df.iterrows():
             rank = df.index.get_loc(analyzed_object)
             pvalue_correction_holm = row[self.statistic_method] * (number_of_test - rank)
@@ -294,11 +639,18 @@ class PandasBasedEnrichmentAnalysis():
         return df
 
     def error_rate_adjustement_bonferroni(self, df):
+        # Without test (e.g. all the objects pruned), there is nothing to select.
+        if len(df.index) == 0:
+            return self.alpha
+
         error_rate_adjusted = self.alpha / len(df.index)
 
         return error_rate_adjusted
 
     def error_rate_adjustement_sidak(self, df):
+        if len(df.index) == 0:
+            return self.alpha
+
         error_rate_adjusted = (1 - math.pow((1 - self.alpha), (1 / len(df.index))))
 
         return error_rate_adjusted
@@ -309,7 +661,7 @@ class PandasBasedEnrichmentAnalysis():
         This selection method is used by Sidak and Bonferroni multiple testing correction.
         '''
 
-        return df[df[self.statistic_method] < error_rate].dropna(0).index.tolist()
+        return df[df[self.statistic_method] < error_rate].dropna(subset=[self.statistic_method]).index.tolist()
 
     def selection_object_with_adjusted_pvalue(self, method_name, df):
         '''
@@ -318,9 +670,14 @@ class PandasBasedEnrichmentAnalysis():
         '''
         df.replace('', np.nan, regex=True, inplace=True)
 
-        return df[df['pValue' + method_name] < self.alpha].dropna(0).index.tolist()
+        return df[df['pValue' + method_name] < self.alpha].dropna(subset=['pValue' + method_name]).index.tolist()
 
-    def enrichment_analysis(self):
+    def compute_enrichment(self):
+        '''
+        Compute the tests and the multiple testing corrections on a copy of the dataframe,
+        without asking to write the results.
+        Return the result dataframe and the dictionary of significative objects.
+        '''
         logger.info('-------------------------------------Enrichment Analysis-------------------------------------')
 
         logger.debug('Name of the column of interest: %s', self.column_interest)
@@ -329,7 +686,22 @@ class PandasBasedEnrichmentAnalysis():
         logger.debug('Number of analyzed objects in reference: %s', self.number_of_analyzed_object_of_reference)
         logger.debug('Alpha: %s', self.alpha)
 
-        dataframe_used = self.dataframe
+        dataframe_used, object_representatives = self.compute_tests()
+        dataframe_used, significative_objects = self.multiple_testing_correction(dataframe_used)
+
+        if object_representatives is not None:
+            dataframe_used = self.expanding_identical_objects(dataframe_used, object_representatives)
+            significative_objects = self.expanding_significative_objects(significative_objects, object_representatives)
+
+        return dataframe_used, significative_objects
+
+    def compute_tests(self):
+        '''
+        Compute the tests on a copy of the dataframe (with pruning and collapsing of the identical objects).
+        Return the dataframe and, if the corrections are computed on the unique gene sets,
+        the series of the representatives of the objects to expand after the corrections (None otherwise).
+        '''
+        dataframe_used = self.dataframe.copy()
 
         percentage_calculator = lambda numerator, denominator: (numerator / denominator) * 100
 
@@ -340,8 +712,30 @@ class PandasBasedEnrichmentAnalysis():
                                                                                 self.number_of_analyzed_object_of_reference)
         logger.debug('input_dataframe: %s', dataframe_used)
 
+        if self.tarone_pruning:
+            dataframe_used = self.pruning_untestable_objects(dataframe_used)
+
+        object_representatives = None
+        if self.identical_objects is not None:
+            dataframe_used, object_representatives = self.collapsing_identical_objects(dataframe_used)
+
         dataframe_used = self.test_on_dataframe(dataframe_used)
-        dataframe_used, significative_objects = self.multiple_testing_correction(dataframe_used)
+
+        if object_representatives is not None and not self.correction_on_unique_gene_sets:
+            dataframe_used = self.expanding_identical_objects(dataframe_used, object_representatives)
+            object_representatives = None
+
+        return dataframe_used, object_representatives
+
+    def compute_lazy_enrichment(self):
+        '''
+        Compute the tests and return a LazyEnrichmentResult, the corrections and the significative objects
+        are computed when they are accessed.
+        '''
+        return LazyEnrichmentResult(self)
+
+    def enrichment_analysis(self):
+        dataframe_used, significative_objects = self.compute_enrichment()
 
         yes_answers = ['yes', 'y', 'oui', 'o']
         yes_or_no = input("Do you want to write results in file? ")
@@ -352,6 +746,33 @@ class PandasBasedEnrichmentAnalysis():
         return dataframe_used
 
 
+def _compute_pvalues_chunk(statistic_method, interest_counts, reference_counts,
+                           number_of_object_of_interest, number_of_genes_in_reference):
+    '''
+    Compute the pvalues of a chunk of objects, it is a module function so it can be sent to a process pool.
+    '''
+    interest_counts = np.asarray(interest_counts, dtype=float)
+    reference_counts = np.asarray(reference_counts, dtype=float)
+
+    if statistic_method == 'pvalue_hypergeometric':
+        return stats.hypergeom.sf(interest_counts - 1, number_of_genes_in_reference,
+                                  reference_counts, number_of_object_of_interest)
+
+    p = reference_counts / number_of_genes_in_reference
+    q = 1 - p
+    t = number_of_object_of_interest / number_of_genes_in_reference
+
+    mu = number_of_object_of_interest * p
+
+    undefined_pvalues = (p == 0) | (q == 0) | (number_of_object_of_interest == 0) | (1 - t == 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = np.sqrt(number_of_object_of_interest * p * q * (1 - t))
+        pvalues_normal = stats.norm.sf(interest_counts, loc=mu, scale=np.where(undefined_pvalues, 1, sigma))
+
+    return np.where(undefined_pvalues, np.nan, pvalues_normal)
+
+
 class AnnotationEnrichmentAnalysis(PandasBasedEnrichmentAnalysis):
     '''
     Annotation (GO terms, Enzyme Codes, Interpro) Enrichment Analysis on data
@@ -394,43 +815,49 @@ class AnnotationEnrichmentAnalysis(PandasBasedEnrichmentAnalysis):
 
         return annotation_labels
 
-    def multiple_testing_correction(self, df):
-        logger.info('-------------------------------------Multiple testing correction with GO translation-------------------------------------')
-        df.sort_values([self.statistic_method], inplace=True)
+    def selection_object(self, multiple_test_name, df):
+        object_significatives = PandasBasedEnrichmentAnalysis.selection_object(self, multiple_test_name, df)
 
-        df = self.correction_bonferroni(df)
-        df = self.correction_benjamini_hochberg(df)
-        df = self.correction_benjamini_yekutieli(df)
-        df = self.correction_holm(df)
+        return self.tranlsation_id_to_label(object_significatives, self.annotation_id_to_labels)
 
-        significative_objects = {}
+    def annotating_dataframe(self, df):
         translation_annotation_id_to_name = self.annotation_id_to_labels
 
         logger.debug('Annotation ID/Label dictionary: %s', len(translation_annotation_id_to_name))
 
-        for multiple_test_name in self.multiple_test_names:
-            if multiple_test_name == 'Sidak':
-                error_rate = self.error_rate_adjustement_sidak(df)
-            elif multiple_test_name == 'Bonferroni':
-                error_rate = self.error_rate_adjustement_bonferroni(df)
-            if multiple_test_name in ['Sidak', 'Bonferroni']:
-                object_significatives = self.selection_object_with_adjusted_error_rate(error_rate, df)
-            elif multiple_test_name in ['Holm', 'BenjaminiHochberg', 'BenjaminiYekutieli']:
-                object_significatives = self.selection_object_with_adjusted_pvalue(multiple_test_name, df)
-
-            annotation_label_significatives = self.tranlsation_id_to_label(object_significatives, translation_annotation_id_to_name)
-            significative_objects[multiple_test_name] = annotation_label_significatives
-
         df[self.annotation] = [translation_annotation_id_to_name[annotation] for annotation in df.index if annotation in translation_annotation_id_to_name]
 
         logger.debug('Dataframe with Annotation labels: %s', df)
 
-        return df, significative_objects
+        return df
+
+    def expanding_identical_objects(self, df, object_representatives):
+        df = PandasBasedEnrichmentAnalysis.expanding_identical_objects(self, df, object_representatives)
+
+        if self.annotation in df.columns:
+            df[self.annotation] = [self.annotation_id_to_labels.get(annotation, np.nan) for annotation in df.index]
+
+        return df
+
+    def expanding_significative_objects(self, significative_objects, object_representatives):
+        '''
+        The significative objects are translated in labels, so the representatives are translated before the expansion.
+        '''
+        translated_objects = [analyzed_object for analyzed_object, representative in object_representatives.items()
+                              if analyzed_object in self.annotation_id_to_labels and representative in self.annotation_id_to_labels]
+        label_representatives = pa.Series([self.annotation_id_to_labels[object_representatives[analyzed_object]] for analyzed_object in translated_objects],
+                                          index=[self.annotation_id_to_labels[analyzed_object] for analyzed_object in translated_objects], dtype=object)
+
+        return PandasBasedEnrichmentAnalysis.expanding_significative_objects(self, significative_objects, label_representatives)
 
 
 class EnrichmentAnalysisExperimental(PandasBasedEnrichmentAnalysis):
     '''
-    Experimental part of the script with SGoF multiple testing correction.
+    Experimental part of the script with SGoF multiple testing correction
+    and Storey q-values (adaptive FDR control with an estimation of the proportion of true null hypotheses pi0).
+    The pi0 of Storey is estimated on the lambdas of storey_lambdas with storey_pi0_method:
+        -'smoother': smoothing of the pi0 estimated at each lambda (Storey & Tibshirani, PNAS 100:9440, 2003).
+        -'bootstrap': lambda minimizing the mean squared error of bootstrap resamples (Storey et al., JRSS B 66:187, 2004).
     '''
     def __init__(self, dataframe, name_column_interest, name_column_reference,
                  number_of_object_of_interest, number_of_genes_in_reference,
@@ -438,82 +865,87 @@ class EnrichmentAnalysisExperimental(PandasBasedEnrichmentAnalysis):
         PandasBasedEnrichmentAnalysis.__init__(self, dataframe, name_column_interest, name_column_reference,
                  number_of_object_of_interest, number_of_genes_in_reference,
                  alpha, threshold_normal_approximation)
-        self.multiple_test_names = ['Sidak', 'Bonferroni', 'Holm', 'SGoF', 'BenjaminiHochberg', 'BenjaminiYekutieli']
-
-    def multiple_testing_correction(self, df):
-        logger.info('-------------------------------------Multiple testing correction-------------------------------------')
-        df = df.sort_values([self.statistic_method])
+        self.output_columns.append('pValueStorey')
+        self.multiple_test_names = ['Sidak', 'Bonferroni', 'Holm', 'SGoF', 'BenjaminiHochberg', 'BenjaminiYekutieli', 'Storey']
+        self._storey_pi0_method = 'smoother'
+        self._storey_lambdas = np.arange(0.05, 0.96, 0.05)
+        self._storey_number_of_bootstraps = 100
+        self._storey_random_state = None
+        self._pi0 = None
 
-        df = self.correction_bonferroni(df)
-        df = self.correction_benjamini_hochberg(df)
-        df = self.correction_benjamini_yekutieli(df)
-        df = self.correction_holm(df)
-        df = self.correction_sgof(df)
-
-        significative_objects = {}
+    @property
+    def storey_pi0_method(self):
+        return self._storey_pi0_method
 
-        for multiple_test_name in self.multiple_test_names:
-            if multiple_test_name == 'Sidak':
-                error_rate = self.error_rate_adjustement_sidak(df)
-            elif multiple_test_name == 'Bonferroni':
-                error_rate = self.error_rate_adjustement_bonferroni(df)
-            if multiple_test_name in ['Sidak', 'Bonferroni']:
-                object_significatives = self.selection_object_with_adjusted_error_rate(error_rate, df)
-            elif multiple_test_name in ['Holm', 'BenjaminiHochberg', 'BenjaminiYekutieli']:
-                object_significatives = self.selection_object_with_adjusted_pvalue(multiple_test_name, df)
-            elif multiple_test_name == 'SGoF':
-                object_significatives = self.selection_object_with_sgof(multiple_test_name, df)
+    @storey_pi0_method.setter
+    def storey_pi0_method(self, pi0_method):
+        if pi0_method not in ['smoother', 'bootstrap']:
+            raise ValueError("The pi0 method must be 'smoother' or 'bootstrap'.")
+        self._storey_pi0_method = pi0_method
 
-            significative_objects[multiple_test_name] = object_significatives
+    @property
+    def storey_lambdas(self):
+        return self._storey_lambdas
 
-        logger.debug('Multiple testing correction dataframe: %s', df)
+    @storey_lambdas.setter
+    def storey_lambdas(self, lambdas):
+        lambdas = np.sort(np.atleast_1d(np.asarray(lambdas, dtype=float)))
+        if len(lambdas) == 0 or lambdas[0] < 0 or lambdas[-1] >= 1:
+            raise ValueError("The lambdas must be in [0, 1).")
+        self._storey_lambdas = lambdas
 
-        return df, significative_objects
+    @property
+    def storey_number_of_bootstraps(self):
+        return self._storey_number_of_bootstraps
 
-    def writing_output(self, df, significative_objects):
-        '''
-        For the second results file (file with significative objects):
-        Results are written using sorted(dictionnary), so the list of result corresponds to : Sidak (position 5 in the list), Bonferroni (position 2),
-        Holm (position 3), SGoF (position 4), Benjamini & Hochberg (position 0) and Benjamini & Yekutieli (position 1).
-        '''
-        logger.info('-------------------------------------Write output-------------------------------------')
-        df.sort_values(['pValueBenjaminiHochberg'], inplace=True)
+    @storey_number_of_bootstraps.setter
+    def storey_number_of_bootstraps(self, number_of_bootstraps):
+        if number_of_bootstraps < 1:
+            raise ValueError("The number of bootstraps must be at least 1.")
+        self._storey_number_of_bootstraps = number_of_bootstraps
 
-        df = df[self.output_columns]
+    @property
+    def storey_random_state(self):
+        return self._storey_random_state
 
-        comment_file = open("results_" + self.object_to_analyze + "_over.tsv", "w")
-        comment_file.write("# Number of objects in reference : " + str(self.number_of_analyzed_object_of_reference) +
-                                        "\t Number of objects in interest : " + str(self.number_of_analyzed_object_of_interest) +"\n")
-        df.to_csv(comment_file, sep="\t", float_format='%.6f', index=True, header=True, quoting=csv.QUOTE_NONE)
+    @storey_random_state.setter
+    def storey_random_state(self, random_state):
+        self._storey_random_state = random_state
 
-        comment_file.close()
+    @property
+    def pi0(self):
+        return self._pi0
 
-        csvfile = open("results_significatives" + self.object_to_analyze + "_over.tsv", "w", newline="")
+    def correction_functions(self):
+        correction_functions = PandasBasedEnrichmentAnalysis.correction_functions(self)
+        correction_functions['SGoF'] = self.correction_sgof
+        correction_functions['Storey'] = self.correction_storey
 
-        writer = csv.writer(csvfile, delimiter="\t")
-        writer.writerow([self.object_to_analyze + 'Sidak', self.object_to_analyze + 'Bonferroni', self.object_to_analyze + 'Holm',
-        self.object_to_analyze + 'SGoF', self.object_to_analyze + 'BenjaminiHochberg', self.object_to_analyze + 'BenjaminiYekutieli'])
+        return correction_functions
 
-        number_significatives_per_method = {}
+    def selection_object(self, multiple_test_name, df):
+        if multiple_test_name == 'SGoF':
+            return self.selection_object_with_sgof(multiple_test_name, df)
+        else:
+            return PandasBasedEnrichmentAnalysis.selection_object(self, multiple_test_name, df)
 
-        for method in significative_objects:
-            number_significatives_per_method[method] = len(significative_objects[method])
+    def writing_output(self, df, significative_objects):
+        '''
+        For the second results file (file with significative objects):
+        Results are written in one column for each multiple test (with the name of the analyzed object as prefix),
+        in the order of multiple_test_names.
+        '''
+        logger.info('-------------------------------------Write output-------------------------------------')
+        df.sort_values([self.sorting_column_output(df)], inplace=True)
 
-        max_significatives_method = max(number_significatives_per_method, key = number_significatives_per_method.get)
+        df = df[[output_column for output_column in self.output_columns if output_column in df.columns]]
 
-        for index in range(len(significative_objects[max_significatives_method])):
-            results = []
-            for method in sorted(significative_objects):
-                if index in range(len(significative_objects[method])):
-                    object_significatives_value = significative_objects[method][index]
-                else:
-                    object_significatives_value = 'nonsignificant'
-                results.append(object_significatives_value)
+        output_paths = ["results_" + self.object_to_analyze + "_over.tsv", "results_significatives" + self.object_to_analyze + "_over.tsv"]
 
-            writer.writerow([results[5], results[2], results[3],
-            results[4], results[0], results[1]])
+        self.writing_output_files(df, significative_objects, output_paths)
 
-        csvfile.close()
+    def significative_objects_header(self, multiple_test_names):
+        return [self.object_to_analyze + multiple_test_name for multiple_test_name in multiple_test_names]
 
     def correction_sgof(self, df):
         '''
@@ -602,7 +1034,68 @@ class EnrichmentAnalysisExperimental(PandasBasedEnrichmentAnalysis):
 
         return df
 
-    def selection_object_with_sgof(self, method_name, df):
-        df.replace(np.nan, '', regex=True, inplace=True)
+    def estimation_pi0(self, pvalues):
+        '''
+        Estimate the proportion of true null hypotheses with the pvalues higher than each lambda:
+        pi0(lambda) = #{pvalue >= lambda} / (m * (1 - lambda)).
+        For the bootstrap, resampling the m pvalues only changes the number of pvalues between two lambdas,
+        so the resamples are drawn at once from a multinomial distribution on these bins
+        (one array of number_of_bootstraps x number of lambdas) instead of resampling the pvalues.
+        '''
+        sorted_pvalues = np.sort(pvalues)
+        number_of_pvalues = len(sorted_pvalues)
+        lambdas = self.storey_lambdas
+
+        number_higher_lambdas = number_of_pvalues - np.searchsorted(sorted_pvalues, lambdas, side='left')
+        pi0_lambdas = number_higher_lambdas / (number_of_pvalues * (1 - lambdas))
+
+        if len(lambdas) == 1:
+            pi0 = pi0_lambdas[0]
+        elif self.storey_pi0_method == 'smoother':
+            # Polynomial with 3 degrees of freedom, like the smoothing spline of the qvalue package.
+            pi0 = np.polyval(np.polyfit(lambdas, pi0_lambdas, 2), lambdas[-1])
+        elif self.storey_pi0_method == 'bootstrap':
+            bin_counts = -np.diff(np.concatenate(([number_of_pvalues], number_higher_lambdas, [0])))
+            random_generator = np.random.default_rng(self.storey_random_state)
+            bootstrap_bin_counts = random_generator.multinomial(number_of_pvalues, bin_counts / number_of_pvalues,
+                                                                size=self.storey_number_of_bootstraps)
+            bootstrap_number_higher_lambdas = np.cumsum(bootstrap_bin_counts[:, :0:-1], axis=1)[:, ::-1]
+            bootstrap_pi0_lambdas = bootstrap_number_higher_lambdas / (number_of_pvalues * (1 - lambdas))
+
+            mean_squared_errors = np.mean((bootstrap_pi0_lambdas - pi0_lambdas.min()) ** 2, axis=0)
+            pi0 = pi0_lambdas[np.argmin(mean_squared_errors)]
+
+        # When all the pvalues are lower than the lambdas (strong enrichment) or when the smoother extrapolates
+        # below 0, pi0 falls back to the smallest positive pi0(lambda), or to 1 (Benjamini & Hochberg).
+        if pi0 <= 0:
+            positive_pi0_lambdas = pi0_lambdas[pi0_lambdas > 0]
+            pi0 = positive_pi0_lambdas.min() if len(positive_pi0_lambdas) > 0 else 1
+            logger.warning('The estimated pi0 is not positive, pi0 = %s is used.', pi0)
+
+        return min(pi0, 1)
+
+    def correction_storey(self, df):
+        '''
+        Storey q-values: the Benjamini & Hochberg adjusted pvalues multiplied by the estimated pi0
+        (Storey & Tibshirani, PNAS 100:9440, 2003).
+        '''
+        df.sort_values(by=self.statistic_method, ascending=True, inplace=True)
+        number_of_test = len(df.index)
 
-        return df[df['pValue' + method_name] == 'significant'].dropna(0).index.tolist()
+        if number_of_test == 0:
+            df['pValueStorey'] = []
+            return df
+
+        self._pi0 = self.estimation_pi0(df[self.statistic_method].values)
+        logger.debug('Storey pi0: %s', self.pi0)
+
+        ranks = np.arange(number_of_test) + 1
+
+        qvalue_storey = self.pi0 * df[self.statistic_method].values * (number_of_test / ranks)
+        qvalue_storey_fixed = np.minimum.accumulate(qvalue_storey[::-1])[::-1]
+        df['pValueStorey'] = np.minimum(1, qvalue_storey_fixed)
+
+        return df
+
+    def selection_object_with_sgof(self, method_name, df):
+        return df.index[df['pValue' + method_name] == 'significant'].tolist()
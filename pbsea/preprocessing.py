@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import os
 import pandas as pa
 import pronto
+import scipy.sparse as sparse
 import urllib.request
 
 from gzip import GzipFile
@@ -71,6 +73,101 @@ def counting_objects(index_column, object_to_analyze, name_path_file_interest, n
 
     return df_int, df_ref
 
+def counting_objects_multiple_namespaces(index_column, objects_to_analyze, name_path_file_interest, name_path_file_reference):
+    '''
+    Count the objects of several namespaces (e.g. GO terms, EC numbers and InterPro domains, one column each
+    in the reference file) with one reading of the files.
+    Return a dictionary with the namespace as key and a tuple (df_int, df_ref) as value,
+    the two dataframes are the same as the ones returned by counting_objects.
+    '''
+    df_reference = pa.read_csv(name_path_file_reference, sep=None,
+                                        engine="python", na_values="")
+    df_reference = df_reference[[index_column] + list(objects_to_analyze)]
+    df_reference.set_index(index_column, inplace=True)
+
+    df_interest = pa.read_csv(name_path_file_interest, sep='\t',
+                                        engine="python", na_values="")
+    interest_genes = set(df_interest[index_column])
+
+    counts_by_namespace = {}
+    for object_to_analyze in objects_to_analyze:
+        gene_objects = df_reference[object_to_analyze].dropna().str.split(',', expand=True).stack().str.strip()
+        genes_of_objects = gene_objects.index.get_level_values(0)
+
+        counts_interest = gene_objects[genes_of_objects.isin(interest_genes)].value_counts()
+        counts_reference = gene_objects.value_counts()
+        counts_interest.index.name = object_to_analyze
+        counts_reference.index.name = object_to_analyze
+
+        counts_by_namespace[object_to_analyze] = (counts_interest.to_frame('count_int'), counts_reference.to_frame('count_ref'))
+
+    return counts_by_namespace
+
+def gene_sets_dictionary_creation(index_column, object_to_analyze, name_path_file_reference):
+    '''
+    Create a dictionary containing the object to analyze (e.g. GO terms) as key
+    and the set of genes annotated with it as value.
+    The reference file is the same as the one used by counting_objects: one column
+    with the genes and one column with the objects separated by commas.
+    '''
+    df_reference = pa.read_csv(name_path_file_reference, sep=None,
+                                        engine="python", na_values="")
+    df_reference = df_reference[[index_column, object_to_analyze]]
+    df_reference.set_index(index_column, inplace=True)
+
+    gene_objects = df_reference[object_to_analyze].dropna().str.split(',', expand=True).stack().str.strip()
+
+    gene_sets = {}
+    for gene, analyzed_object in zip(gene_objects.index.get_level_values(0), gene_objects.values):
+        gene_sets.setdefault(analyzed_object, set()).add(gene)
+
+    return gene_sets
+
+def incidence_matrix_creation(gene_sets, analyzed_objects=None, genes=None):
+    '''
+    Create a sparse boolean matrix (objects in rows, genes in columns) from a dictionary
+    created by gene_sets_dictionary_creation.
+    Return the matrix (in CSR format), the list of objects (order of the rows)
+    and the list of genes (order of the columns).
+    '''
+    if analyzed_objects is None:
+        analyzed_objects = sorted(gene_sets)
+    if genes is None:
+        genes = sorted(set().union(*[gene_sets[analyzed_object] for analyzed_object in analyzed_objects]))
+
+    gene_to_column = {gene: column for column, gene in enumerate(genes)}
+
+    rows = []
+    columns = []
+    for row, analyzed_object in enumerate(analyzed_objects):
+        object_columns = [gene_to_column[gene] for gene in gene_sets[analyzed_object] if gene in gene_to_column]
+        rows.extend([row] * len(object_columns))
+        columns.extend(object_columns)
+
+    incidence_matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                        shape=(len(analyzed_objects), len(genes)))
+    incidence_matrix.sort_indices()
+
+    return incidence_matrix, list(analyzed_objects), list(genes)
+
+def identical_gene_sets_grouping(gene_sets):
+    '''
+    Group the objects annotating exactly the same genes (e.g. a GO term and its only child).
+    The genes of each object are the sorted columns of its row in the incidence matrix, their bytes
+    are hashed in a dictionary so each unique gene set is found in one pass.
+    Return a dictionary containing the object as key and the representative of its gene set
+    (the first object of the set in sorted order) as value.
+    '''
+    incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(gene_sets)
+
+    representative_of_gene_sets = {}
+    object_representatives = {}
+    for row, analyzed_object in enumerate(analyzed_objects):
+        gene_set_key = incidence_matrix.indices[incidence_matrix.indptr[row]:incidence_matrix.indptr[row + 1]].tobytes()
+        object_representatives[analyzed_object] = representative_of_gene_sets.setdefault(gene_set_key, analyzed_object)
+
+    return object_representatives
+
 def go_translation_dictionary_creation():
     '''
     Create a dictionary containing GO number as key
@@ -89,6 +186,29 @@ def go_translation_dictionary_creation():
 
     return go_number_to_labels
 
+def go_parents_dictionary_creation():
+    '''
+    Create a dictionary containing GO number as key
+    and the list of its parents (is_a relations) as value.
+    This function needs an internet connexion because it is
+    interrogating the Gene Ontology with Pronto module.
+    Use it to create the dictionary needed in the
+    TopologyEnrichmentAnalysis class.
+    '''
+    go_number_to_parents = {}
+
+    go_ontology = pronto.Ontology('http://purl.obolibrary.org/obo/go/go-basic.obo')
+
+    # Pronto 2 iterates on identifiers and gives the parents with superclasses().
+    if hasattr(go_ontology, 'terms'):
+        for go_term in go_ontology.terms():
+            go_number_to_parents[go_term.id] = [parent.id for parent in go_term.superclasses(distance=1, with_self=False)]
+    else:
+        for go_term in go_ontology:
+            go_number_to_parents[go_term.id] = [parent.id for parent in go_term.parents]
+
+    return go_number_to_parents
+
 def ec_translation_dictionary_creation():
     '''
     Create a dictionary containing EC number as key
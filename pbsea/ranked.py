@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+import logging
+import numpy as np
+import pandas as pa
+import scipy.special as special
+
+from pbsea.pbsea import PandasBasedEnrichmentAnalysis
+from pbsea.preprocessing import incidence_matrix_creation
+
+logger = logging.getLogger(__name__)
+
+
+def minimum_hypergeometric_test(ranked_genes, gene_sets, maximum_cutoff=None):
+    '''
+    Threshold-free enrichment analysis of a ranked list of genes (the most interesting genes first)
+    using the minimum hypergeometric (mHG) test of Eden et al. (PLoS Computational Biology 3:e39, 2007).
+    For each object (e.g. GO term), all the cutoffs of the ranking (until maximum_cutoff) are scanned
+    and the cutoff with the lowest hypergeometric tail (mHG) is kept.
+    The hypergeometric tail only decreases when a gene of the object is found, so the number of genes
+    of the object above each cutoff is obtained with a prefix count of the ranks of its genes
+    and the tails are computed only at these ranks, for all the objects at once (see hypergeometric_tails_computation).
+    The mHG is corrected for the scan of all the cutoffs with the exact pvalue (see exact_mhg_pvalues),
+    its cost is in O(N * sum(B)) with N the number of cutoffs scanned and sum(B) the sum of the sizes of the objects:
+    for long rankings, maximum_cutoff bounds N.
+    Return a dataframe with the objects in index and the columns Counts (genes of the object above
+    the optimal cutoff), CountsReference (genes of the object in the ranking), OptimalCutoff, mHG and pvalue_mHG.
+    When the mHG is 1 (e.g. no gene of the object above maximum_cutoff), OptimalCutoff and Counts are 0.
+    '''
+    number_of_genes = len(ranked_genes)
+    if maximum_cutoff is None:
+        maximum_cutoff = number_of_genes
+
+    ranked_gene_set = set(ranked_genes)
+    analyzed_objects = sorted(analyzed_object for analyzed_object in gene_sets
+                              if not gene_sets[analyzed_object].isdisjoint(ranked_gene_set))
+
+    # Columns of the incidence matrix are the ranks, and the sorted indices of a row are the ranks of the genes of the object.
+    incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(gene_sets, analyzed_objects, list(ranked_genes))
+
+    object_sizes = np.diff(incidence_matrix.indptr)
+    object_of_hits = np.repeat(np.arange(len(analyzed_objects)), object_sizes)
+    cutoffs = incidence_matrix.indices + 1
+    hits = np.arange(len(cutoffs)) - np.repeat(incidence_matrix.indptr[:-1], object_sizes) + 1
+
+    # Only the cutoffs until maximum_cutoff are scanned, an object without gene above maximum_cutoff has a mHG of 1.
+    hypergeometric_tails = np.full(len(cutoffs), np.inf)
+    in_scan = cutoffs <= maximum_cutoff
+    hypergeometric_tails[in_scan] = hypergeometric_tails_computation(hits[in_scan], object_sizes[object_of_hits[in_scan]],
+                                                                     cutoffs[in_scan], number_of_genes)
+
+    minimum_tails = np.minimum(np.minimum.reduceat(hypergeometric_tails, incidence_matrix.indptr[:-1]), 1)
+
+    # The optimal cutoff is the first cutoff reaching the mHG, there is no optimal cutoff (0) when the mHG is 1.
+    optimal_counts = np.zeros(len(analyzed_objects), dtype=np.int64)
+    optimal_cutoffs = np.zeros(len(analyzed_objects), dtype=np.int64)
+    minimum_positions = np.flatnonzero((hypergeometric_tails == minimum_tails[object_of_hits]) & (hypergeometric_tails < 1))
+    minimum_objects, first_minimums = np.unique(object_of_hits[minimum_positions], return_index=True)
+    optimal_counts[minimum_objects] = hits[minimum_positions[first_minimums]]
+    optimal_cutoffs[minimum_objects] = cutoffs[minimum_positions[first_minimums]]
+
+    df = pa.DataFrame({'Counts': optimal_counts,
+                       'CountsReference': object_sizes,
+                       'OptimalCutoff': optimal_cutoffs,
+                       'mHG': minimum_tails,
+                       'pvalue_mHG': exact_mhg_pvalues(minimum_tails, object_sizes, number_of_genes, maximum_cutoff)},
+                      index=analyzed_objects,
+                      columns=['Counts', 'CountsReference', 'OptimalCutoff', 'mHG', 'pvalue_mHG'])
+
+    return df
+
+def _stirling_error(numbers):
+    '''
+    Error of the Stirling approximation: log(n!) - log(sqrt(2 * pi * n) * (n / e)**n), with the series of Loader (2000)
+    for n > 15, so the large factorials cancel without rounding error.
+    '''
+    numbers = np.asarray(numbers, dtype=float)
+    errors = np.zeros(len(numbers))
+
+    small_numbers = (numbers > 0) & (numbers <= 15)
+    errors[small_numbers] = special.gammaln(numbers[small_numbers] + 1) - (numbers[small_numbers] + 0.5) * np.log(numbers[small_numbers]) \
+                            + numbers[small_numbers] - 0.5 * np.log(2 * np.pi)
+
+    large_numbers = numbers[numbers > 15]
+    squares = large_numbers * large_numbers
+    errors[numbers > 15] = (1 / 12 - (1 / 360 - (1 / 1260 - (1 / 1680 - 1 / 1188 / squares) / squares) / squares) / squares) / large_numbers
+
+    return errors
+
+def _binomial_deviance(numbers, means):
+    '''
+    Deviance x * log(x / m) + m - x, with a series when x is close to m (Loader, 2000).
+    '''
+    deviances = numbers * np.log(np.where(numbers > 0, numbers, 1) / means) + means - numbers
+
+    close_numbers = np.abs(numbers - means) < 0.1 * (numbers + means)
+    ratios = (numbers[close_numbers] - means[close_numbers]) / (numbers[close_numbers] + means[close_numbers])
+    series = (numbers[close_numbers] - means[close_numbers]) * ratios
+    series_terms = 2 * numbers[close_numbers] * ratios
+    # |ratio| < 0.1, so each term is at least 100 times smaller than the previous one.
+    for term_number in range(1, 12):
+        series_terms *= ratios * ratios
+        series += series_terms / (2 * term_number + 1)
+    deviances[close_numbers] = series
+
+    return deviances
+
+def _binomial_pmf(numbers, trials, probability, complement_probability):
+    '''
+    Binomial pmf computed with the saddle point expansion of Loader (2000), as the dbinom function of R.
+    '''
+    pmf = np.empty(len(numbers))
+
+    no_success = numbers == 0
+    pmf[no_success] = np.power(complement_probability[no_success], trials[no_success])
+    all_success = (numbers == trials) & ~no_success
+    pmf[all_success] = np.power(probability[all_success], trials[all_success])
+
+    others = ~(no_success | all_success)
+    numbers, trials = numbers[others], trials[others]
+    log_pmf = _stirling_error(trials) - _stirling_error(numbers) - _stirling_error(trials - numbers) \
+              - _binomial_deviance(numbers, trials * probability[others]) - _binomial_deviance(trials - numbers, trials * complement_probability[others])
+    pmf[others] = np.exp(log_pmf) / np.sqrt(2 * np.pi * numbers * (1 - numbers / trials))
+
+    return pmf
+
+def hypergeometric_pmf(hits, object_sizes, cutoffs, number_of_genes):
+    '''
+    Hypergeometric pmf P(X = hits) for an object of object_sizes genes among number_of_genes genes and cutoffs genes drawn,
+    computed as a ratio of binomial pmfs (like the dhyper function of R), accurate for large numbers of genes.
+    '''
+    hits, object_sizes, cutoffs = [np.asarray(values, dtype=float) for values in [hits, object_sizes, cutoffs]]
+    probability = cutoffs / number_of_genes
+    complement_probability = (number_of_genes - cutoffs) / number_of_genes
+
+    return _binomial_pmf(hits, object_sizes, probability, complement_probability) \
+           * _binomial_pmf(cutoffs - hits, number_of_genes - object_sizes, probability, complement_probability) \
+           / _binomial_pmf(cutoffs, np.full(len(cutoffs), float(number_of_genes)), probability, complement_probability)
+
+def hypergeometric_tails_computation(hits, object_sizes, cutoffs, number_of_genes):
+    '''
+    Hypergeometric tails P(X >= hits) of many points at once. Above the mean, the tail is the sum of the pmf from hits,
+    below the mean it is 1 minus the sum of the pmf until hits - 1. The sums start with the pmf at one point
+    and the next terms are obtained with the ratio of successive pmf values, until they are negligible:
+    each tail costs a few terms around the point instead of a computation from scratch.
+    '''
+    hits, object_sizes, cutoffs = [np.asarray(values, dtype=float) for values in [hits, object_sizes, cutoffs]]
+    tails = np.zeros(len(hits))
+
+    above_mean = hits * number_of_genes > cutoffs * object_sizes
+    start_hits = np.where(above_mean, hits, hits - 1)
+    valid_points = (start_hits >= np.maximum(0, cutoffs + object_sizes - number_of_genes)) & (start_hits <= np.minimum(object_sizes, cutoffs))
+    tails[~above_mean & ~valid_points] = 1
+
+    for is_above_mean in [True, False]:
+        points = np.flatnonzero((above_mean == is_above_mean) & valid_points)
+        current_hits = start_hits[points]
+        sizes, draws = object_sizes[points], cutoffs[points]
+        terms = hypergeometric_pmf(current_hits, sizes, draws, number_of_genes)
+        sums = terms.copy()
+
+        active = np.arange(len(points))
+        while len(active) > 0:
+            x, size, draw = current_hits[active], sizes[active], draws[active]
+            if is_above_mean:
+                terms[active] *= (size - x) * (draw - x) / ((x + 1) * (number_of_genes - size - draw + x + 1))
+                current_hits[active] = x + 1
+            else:
+                terms[active] *= x * (number_of_genes - size - draw + x) / ((size - x + 1) * (draw - x + 1))
+                current_hits[active] = x - 1
+            sums[active] += terms[active]
+            active = active[terms[active] > sums[active] * 1e-17]
+
+        tails[points] = sums if is_above_mean else 1 - sums
+
+    return np.clip(tails, 0, 1)
+
+def exact_mhg_pvalues(mhg_values, object_sizes, number_of_genes, maximum_cutoff=None):
+    '''
+    Compute the exact pvalue of the mHG statistic, the probability that a random ranking reaches
+    a hypergeometric tail lower or equal to the mHG at one of its cutoffs.
+    This is the path counting of Eden et al. (2007): a random ranking is a path in the (cutoff, hits) lattice
+    and the pvalue is the probability of the paths entering the region where the tail is lower or equal to the mHG.
+    The lattices of all the objects are put end to end in one array and walked together, one cutoff at a time,
+    with the probability of being on each (cutoff, hits) point, the hypergeometric pmf and tail updated incrementally.
+    The cost is in O(N * sum(B)) with N = min(maximum_cutoff, number_of_genes) and sum(B) the sum of the object sizes,
+    so maximum_cutoff bounds it for long rankings.
+    '''
+    if maximum_cutoff is None:
+        maximum_cutoff = number_of_genes
+
+    mhg_values = np.asarray(mhg_values, dtype=float)
+    object_sizes = np.asarray(object_sizes, dtype=np.int64)
+    pvalues = np.ones(len(mhg_values))
+
+    # An mHG of 1 is reached by all the paths.
+    objects_to_walk = np.flatnonzero(mhg_values < 1)
+    if len(objects_to_walk) == 0:
+        return pvalues
+
+    segment_sizes = object_sizes[objects_to_walk] + 1
+    segment_starts = np.concatenate(([0], np.cumsum(segment_sizes)[:-1]))
+    segment_of_points = np.repeat(np.arange(len(objects_to_walk)), segment_sizes)
+    hits = np.arange(segment_sizes.sum()) - segment_starts[segment_of_points]
+    remaining_hits = (object_sizes[objects_to_walk][segment_of_points] - hits).astype(float)
+    # A relative tolerance avoids missing the observed point because of rounding differences.
+    region_thresholds = mhg_values[objects_to_walk][segment_of_points] * (1 + 1e-9)
+
+    path_probabilities = np.zeros(len(hits))
+    path_probabilities[segment_starts] = 1
+    hypergeometric_pmf = path_probabilities.copy()
+    hypergeometric_tails = path_probabilities.copy()
+    absorbed_probabilities = np.zeros(len(hits))
+
+    hit_probabilities = np.empty(len(hits))
+    moving_probabilities = np.empty(len(hits))
+    in_region = np.empty(len(hits), dtype=bool)
+
+    number_of_steps = min(maximum_cutoff, number_of_genes)
+    inverse_remaining_genes = 1 / (number_of_genes - np.arange(number_of_steps, dtype=float))
+
+    # The last point of each lattice has no remaining hit, so shifting by one never moves probability to the next lattice.
+    for cutoff in range(number_of_steps):
+        np.multiply(remaining_hits, inverse_remaining_genes[cutoff], out=hit_probabilities)
+
+        np.multiply(hypergeometric_pmf, hit_probabilities, out=moving_probabilities)
+        hypergeometric_pmf -= moving_probabilities
+        hypergeometric_pmf[1:] += moving_probabilities[:-1]
+        hypergeometric_tails[1:] += moving_probabilities[:-1]
+
+        np.multiply(path_probabilities, hit_probabilities, out=moving_probabilities)
+        path_probabilities -= moving_probabilities
+        path_probabilities[1:] += moving_probabilities[:-1]
+
+        np.less_equal(hypergeometric_tails, region_thresholds, out=in_region)
+        np.multiply(path_probabilities, in_region, out=moving_probabilities)
+        absorbed_probabilities += moving_probabilities
+        path_probabilities -= moving_probabilities
+
+    absorbed_probabilities = np.add.reduceat(absorbed_probabilities, segment_starts)
+    pvalues[objects_to_walk] = np.minimum(absorbed_probabilities, 1)
+
+    return pvalues
+
+
+class RankedEnrichmentAnalysis(PandasBasedEnrichmentAnalysis):
+    '''
+    Threshold-free enrichment analysis of a ranked list of genes using the minimum hypergeometric test.
+    Instead of one analysis for each cutoff of the ranking, all the cutoffs are scanned for each object
+    and the multiple testing corrections are applied on the corrected mHG pvalues (pvalue_mHG).
+        -ranked_genes: list of all the genes, sorted from the most interesting one.
+        -gene_sets: dictionary containing the object to analyze as key and its set of genes as value
+         (it can be created with gene_sets_dictionary_creation).
+        -alpha : the alpha threshold also known as type I error.
+        -maximum_cutoff: the last cutoff scanned (by default the length of the ranking).
+    '''
+    def __init__(self, ranked_genes, gene_sets, alpha, maximum_cutoff=None):
+        self._ranked_genes = list(ranked_genes)
+        self._gene_sets = gene_sets
+        self._maximum_cutoff = len(self._ranked_genes) if maximum_cutoff is None else maximum_cutoff
+
+        incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(gene_sets, sorted(gene_sets), self._ranked_genes)
+        object_sizes = np.diff(incidence_matrix.indptr)
+        hits_above_maximum_cutoff = np.asarray(incidence_matrix[:, :self._maximum_cutoff].sum(axis=1)).ravel()
+        dataframe = pa.DataFrame({'Counts': hits_above_maximum_cutoff, 'CountsReference': object_sizes},
+                                 index=analyzed_objects, columns=['Counts', 'CountsReference'])
+        dataframe = dataframe[dataframe['CountsReference'] > 0]
+
+        PandasBasedEnrichmentAnalysis.__init__(self, dataframe, 'Counts', 'CountsReference',
+                 self._maximum_cutoff, len(self._ranked_genes), alpha, np.inf)
+
+    @property
+    def maximum_cutoff(self):
+        return self._maximum_cutoff
+
+    def test_on_dataframe(self, df):
+        self.statistic_method = 'pvalue_mHG'
+        self.output_columns[4] = 'pvalue_mHG'
+
+        df_mhg = minimum_hypergeometric_test(self._ranked_genes, {analyzed_object: self._gene_sets[analyzed_object] for analyzed_object in df.index},
+                                             self.maximum_cutoff)
+
+        df = df.copy()
+        for column in ['Counts', 'OptimalCutoff', 'mHG', 'pvalue_mHG']:
+            df[column] = df_mhg[column]
+        df['PercentageInInterest'] = (df['Counts'] / df['OptimalCutoff'].replace(0, np.nan)).fillna(0) * 100
+        df = df.sort_values(self.statistic_method)
+
+        return df
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import logging
+import numpy as np
+import pandas as pa
+
+from pbsea.pbsea import PandasBasedEnrichmentAnalysis
+from pbsea.snapshot import counting_interest_objects
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentReference():
+    '''
+    Immutable reference shared by concurrent analyses: the objects (e.g. GO terms), their counts
+    in the reference and the number of genes in the reference.
+    The arrays are read-only and nothing is modified after the creation, so one reference
+    can be used by many threads at the same time without copy.
+    A reference created from a ReferenceSnapshot can also count the objects of a list of genes.
+    '''
+    def __init__(self, analyzed_objects, reference_counts, number_of_genes_in_reference,
+                 name_column_reference='CountsReference', incidence_matrix=None, gene_to_column=None):
+        self._analyzed_objects = pa.Index(analyzed_objects)
+        # Build the hash table of the index now, instead of building it at the first (concurrent) lookup.
+        self._analyzed_objects.get_indexer(self._analyzed_objects[:1])
+
+        # Read-only arrays (e.g. from a snapshot) are shared, the others are copied so the caller can not modify them.
+        self._reference_counts = np.asarray(reference_counts)
+        if self._reference_counts.flags.writeable:
+            self._reference_counts = self._reference_counts.copy()
+            self._reference_counts.flags.writeable = False
+        self._number_of_genes_in_reference = number_of_genes_in_reference
+        self._name_column_reference = name_column_reference
+
+        self._incidence_matrix = incidence_matrix
+        self._gene_to_column = gene_to_column
+
+    @classmethod
+    def from_dataframe(cls, df, name_column_reference, number_of_genes_in_reference):
+        '''
+        Create a reference from a dataframe with the objects in index and their counts in name_column_reference
+        (for example the reference dataframe returned by counting_objects).
+        '''
+        return cls(df.index, df[name_column_reference].values, number_of_genes_in_reference, name_column_reference)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, name_column_reference='CountsReference'):
+        '''
+        Create a reference from a ReferenceSnapshot, the counts and the incidence matrix stay in the memory-mapped file
+        and the genes are counted like with ReferenceSnapshot.counting_objects_in_interest (same dictionary of the genes).
+        '''
+        return cls(snapshot.object_ids, snapshot.reference_counts, snapshot.number_of_genes_in_reference,
+                   name_column_reference, snapshot.incidence_matrix, snapshot.gene_to_column)
+
+    @property
+    def analyzed_objects(self):
+        return self._analyzed_objects
+
+    @property
+    def reference_counts(self):
+        return self._reference_counts
+
+    @property
+    def number_of_genes_in_reference(self):
+        return self._number_of_genes_in_reference
+
+    @property
+    def name_column_reference(self):
+        return self._name_column_reference
+
+    def counting_objects_in_interest(self, interest_genes):
+        '''
+        Count the objects of a list of genes of interest (only for a reference created from a snapshot).
+        Return a series with the counts of the objects found in the interest and the number of genes
+        of interest found in the reference.
+        '''
+        if self._incidence_matrix is None:
+            raise ValueError("The reference has no incidence matrix, create it from a snapshot to count genes.")
+
+        objects_in_interest, interest_counts, number_of_genes_found = counting_interest_objects(self._incidence_matrix, self._gene_to_column,
+                                                                                               interest_genes)
+
+        return pa.Series(interest_counts, index=self.analyzed_objects[objects_in_interest]), number_of_genes_found
+
+    def dataframe_of_interest(self, interest_counts, name_column_interest='Counts'):
+        '''
+        Create a new dataframe (objects of interest in index, counts in interest and counts in reference)
+        from a series with the counts of the objects in the interest. The reference is not modified.
+        '''
+        interest_counts = pa.Series(interest_counts)
+        positions = self.analyzed_objects.get_indexer(interest_counts.index)
+        found_objects = positions >= 0
+
+        df = pa.DataFrame({name_column_interest: interest_counts.values[found_objects],
+                           self.name_column_reference: self.reference_counts[positions[found_objects]]},
+                          index=interest_counts.index[found_objects],
+                          columns=[name_column_interest, self.name_column_reference])
+
+        return df
+
+
+def enrichment_analysis_on_reference(reference, interest_counts, number_of_object_of_interest, alpha,
+                                     threshold_normal_approximation, analysis_class=PandasBasedEnrichmentAnalysis,
+                                     name_column_interest='Counts'):
+    '''
+    Reentrant enrichment analysis of the counts of a list of interest against a shared EnrichmentReference.
+    All the state of the run (dataframe, statistic method, output columns) belongs to a new analysis object
+    created for the call, so this function can be called concurrently from many threads with the same reference.
+    analysis_class can be any class taking the arguments of PandasBasedEnrichmentAnalysis
+    (for example EnrichmentAnalysisExperimental).
+    Return a new result dataframe and the dictionary of significative objects.
+    '''
+    df = reference.dataframe_of_interest(interest_counts, name_column_interest)
+
+    analysis = analysis_class(df, name_column_interest, reference.name_column_reference,
+                              number_of_object_of_interest, reference.number_of_genes_in_reference,
+                              alpha, threshold_normal_approximation)
+
+    return analysis.compute_enrichment()
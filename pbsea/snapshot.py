@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import mmap
+import numpy as np
+import os
+import pandas as pa
+import scipy.sparse as sparse
+import struct
+
+from pbsea.preprocessing import gene_sets_dictionary_creation, incidence_matrix_creation
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'PBSEASNP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGNMENT = 8
+
+
+def write_reference_snapshot(path_snapshot, gene_sets, number_of_genes_in_reference=None, reference_counts=None):
+    '''
+    Write a prepared reference in a single binary file which can be opened with ReferenceSnapshot.
+    The file contains the objects IDs (e.g. GO terms), their counts in the reference, the object/gene incidence
+    matrix (in CSR format), the genes IDs and the number of genes in the reference.
+        -gene_sets: dictionary containing the object to analyze as key and its set of genes as value
+         (it can be created with gene_sets_dictionary_creation).
+        -number_of_genes_in_reference: by default the number of genes in gene_sets.
+        -reference_counts: dictionary containing the object as key and its count in the reference as value,
+         by default the number of genes of each object.
+    The file is written in a temporary file and renamed, so a reader never sees a half-written snapshot.
+    '''
+    incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(gene_sets)
+
+    if number_of_genes_in_reference is None:
+        number_of_genes_in_reference = len(genes)
+    if reference_counts is None:
+        counts = np.diff(incidence_matrix.indptr).astype(np.int64)
+    else:
+        counts = np.array([reference_counts[analyzed_object] for analyzed_object in analyzed_objects], dtype=np.int64)
+
+    # Index arrays with the same dtype are used by scipy without copy.
+    index_dtype = np.int32 if max(incidence_matrix.nnz, len(genes), len(analyzed_objects)) < np.iinfo(np.int32).max else np.int64
+
+    object_blob, object_offsets = _encode_strings(analyzed_objects)
+    gene_blob, gene_offsets = _encode_strings(genes)
+
+    arrays = [('reference_counts', counts),
+              ('indptr', incidence_matrix.indptr.astype(index_dtype)),
+              ('indices', incidence_matrix.indices.astype(index_dtype)),
+              ('data', np.ones(incidence_matrix.nnz, dtype=np.int8)),
+              ('object_offsets', object_offsets),
+              ('object_blob', object_blob),
+              ('gene_offsets', gene_offsets),
+              ('gene_blob', gene_blob)]
+
+    header = {'version': SNAPSHOT_VERSION,
+              'number_of_objects': len(analyzed_objects),
+              'number_of_genes': len(genes),
+              'number_of_genes_in_reference': int(number_of_genes_in_reference),
+              'arrays': {}}
+
+    # Offsets are relative to the start of the data, so they do not depend on the size of the header.
+    data_offset = 0
+    for array_name, array in arrays:
+        header['arrays'][array_name] = [data_offset, array.dtype.str, len(array)]
+        data_offset = _aligned(data_offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+    path_temporary = path_snapshot + '.tmp'
+    with open(path_temporary, 'wb') as snapshot_file:
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(struct.pack('<Q', len(header_bytes)))
+        snapshot_file.write(header_bytes)
+        for array_name, array in arrays:
+            snapshot_file.write(b'\0' * (data_start + header['arrays'][array_name][0] - snapshot_file.tell()))
+            snapshot_file.write(array.tobytes())
+    os.replace(path_temporary, path_snapshot)
+
+    logger.info('Reference snapshot written in %s: %s objects, %s genes', path_snapshot, len(analyzed_objects), len(genes))
+
+def reference_snapshot_creation(index_column, object_to_analyze, name_path_file_reference, path_snapshot,
+                                number_of_genes_in_reference=None):
+    '''
+    Create a reference snapshot from a reference file (the same as the one used by counting_objects).
+    '''
+    gene_sets = gene_sets_dictionary_creation(index_column, object_to_analyze, name_path_file_reference)
+    write_reference_snapshot(path_snapshot, gene_sets, number_of_genes_in_reference)
+
+def counting_interest_objects(incidence_matrix, gene_to_column, interest_genes):
+    '''
+    Count the objects of a list of genes of interest with an incidence matrix (objects in rows, genes in columns).
+    Return the rows of the objects found in the interest, their counts and the number of genes of interest found.
+    '''
+    interest_columns = [gene_to_column[gene] for gene in set(interest_genes) if gene in gene_to_column]
+    interest_mask = np.zeros(incidence_matrix.shape[1], dtype=np.int64)
+    interest_mask[interest_columns] = 1
+
+    interest_counts = incidence_matrix.dot(interest_mask)
+    objects_in_interest = np.flatnonzero(interest_counts)
+
+    return objects_in_interest, interest_counts[objects_in_interest], len(interest_columns)
+
+def _aligned(offset):
+    return offset + (-offset % SNAPSHOT_ALIGNMENT)
+
+def _encode_strings(strings):
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded_strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(encoded_string) for encoded_string in encoded_strings])
+
+    return np.frombuffer(b''.join(encoded_strings), dtype=np.uint8), offsets
+
+def _decode_strings(blob, offsets):
+    blob_bytes = blob.tobytes()
+
+    return [blob_bytes[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class ReferenceSnapshot():
+    '''
+    Read-only access to a reference snapshot written by write_reference_snapshot.
+    The file is memory-mapped and the arrays are views on the mapping (no copy, no parsing),
+    so several processes opening the same snapshot share one copy of it in the page cache.
+    The IDs of the objects and genes are only decoded when they are needed.
+    '''
+    def __init__(self, path_snapshot):
+        self._path_snapshot = path_snapshot
+        with open(path_snapshot, 'rb') as snapshot_file:
+            self._mapping = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mapping[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            self._mapping.close()
+            raise ValueError(path_snapshot + " is not a reference snapshot.")
+
+        header_length = struct.unpack('<Q', self._mapping[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 8])[0]
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        self._header = json.loads(self._mapping[header_start:header_start + header_length].decode('utf-8'))
+
+        if self._header['version'] != SNAPSHOT_VERSION:
+            self._mapping.close()
+            raise ValueError("The version of the snapshot " + path_snapshot + " is not supported.")
+
+        data_start = _aligned(header_start + header_length)
+        self._arrays = {}
+        for array_name, (array_offset, array_dtype, array_length) in self._header['arrays'].items():
+            self._arrays[array_name] = np.frombuffer(self._mapping, dtype=np.dtype(array_dtype),
+                                                     count=array_length, offset=data_start + array_offset)
+
+        self._object_ids = None
+        self._gene_to_column = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Close the mapping. If arrays obtained from the snapshot are still used,
+        the mapping is released when the last of them is deleted.
+        '''
+        self._arrays = {}
+        try:
+            self._mapping.close()
+        except BufferError:
+            logger.debug('Snapshot %s still used, the mapping will be released with its last array.', self._path_snapshot)
+
+    @property
+    def number_of_genes_in_reference(self):
+        return self._header['number_of_genes_in_reference']
+
+    @property
+    def reference_counts(self):
+        return self._arrays['reference_counts']
+
+    @property
+    def incidence_matrix(self):
+        return sparse.csr_matrix((self._arrays['data'], self._arrays['indices'], self._arrays['indptr']),
+                                 shape=(self._header['number_of_objects'], self._header['number_of_genes']), copy=False)
+
+    @property
+    def object_ids(self):
+        if self._object_ids is None:
+            self._object_ids = _decode_strings(self._arrays['object_blob'], self._arrays['object_offsets'])
+        return self._object_ids
+
+    @property
+    def gene_ids(self):
+        return _decode_strings(self._arrays['gene_blob'], self._arrays['gene_offsets'])
+
+    @property
+    def gene_to_column(self):
+        '''
+        Dictionary with the gene ID as key and its column in the incidence matrix as value, decoded once.
+        '''
+        if self._gene_to_column is None:
+            self._gene_to_column = {gene: column for column, gene in enumerate(self.gene_ids)}
+        return self._gene_to_column
+
+    def reference_dataframe(self, name_column_reference='count_ref'):
+        '''
+        Return the counts of the objects in the reference as a dataframe (like the one returned by counting_objects).
+        '''
+        return pa.DataFrame({name_column_reference: self.reference_counts}, index=self.object_ids)
+
+    def counting_objects_in_interest(self, interest_genes, name_column_interest='count_int', name_column_reference='count_ref'):
+        '''
+        Count the objects of a list of genes of interest with the incidence matrix of the snapshot.
+        Return a dataframe compatible with PandasBasedEnrichmentAnalysis (objects present in the interest in index,
+        a column with the counts in interest and a column with the counts in reference)
+        and the number of genes of interest found in the reference.
+        '''
+        objects_in_interest, interest_counts, number_of_genes_found = counting_interest_objects(self.incidence_matrix, self.gene_to_column,
+                                                                                               interest_genes)
+
+        object_ids = self.object_ids
+        df = pa.DataFrame({name_column_interest: interest_counts,
+                           name_column_reference: self.reference_counts[objects_in_interest]},
+                          index=[object_ids[object_index] for object_index in objects_in_interest],
+                          columns=[name_column_interest, name_column_reference])
+
+        return df, number_of_genes_found
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import logging
+import numpy as np
+import os
+import pandas as pa
+import shutil
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+STORE_CATALOG = 'catalog.sqlite'
+
+
+class EnrichmentResultStore():
+    '''
+    Append-only store of the results of many enrichment analyses, to query the results of all the runs
+    (e.g. the lists where GO:0006783 has a pValueBenjaminiHochberg lower than 0.01) without reading all the result files.
+    The rows of a run are written in segments (a directory of the run containing one .npy file for each numeric column),
+    sorted by object so the rows of one object are contiguous. A SQLite catalog contains for each segment the range
+    of rows of each object (the object index) and the minimum and maximum of each column, for the whole segment
+    and for each object. The queries only read the ranges of rows which can match (the files are memory-mapped).
+    Only one process should write in a store at a time.
+    '''
+    def __init__(self, path_store):
+        self._path_store = path_store
+        os.makedirs(path_store, exist_ok=True)
+
+        self._connection = sqlite3.connect(os.path.join(path_store, STORE_CATALOG))
+        self._connection.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, created_at REAL);
+            CREATE TABLE IF NOT EXISTS lists (list_id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, list_name TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS objects (object_id INTEGER PRIMARY KEY, object_name TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS segments (segment_id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, path TEXT NOT NULL,
+                                                 number_of_rows INTEGER NOT NULL, columns TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS segment_statistics (segment_id INTEGER, column_name TEXT, minimum REAL, maximum REAL);
+            CREATE TABLE IF NOT EXISTS object_index (segment_id INTEGER, object_id INTEGER, start_row INTEGER, end_row INTEGER);
+            CREATE TABLE IF NOT EXISTS object_statistics (segment_id INTEGER, object_id INTEGER, column_name TEXT,
+                                                          minimum REAL, maximum REAL);
+            CREATE INDEX IF NOT EXISTS object_index_object ON object_index (object_id);
+            CREATE INDEX IF NOT EXISTS object_statistics_object ON object_statistics (object_id, column_name, segment_id);
+            CREATE INDEX IF NOT EXISTS object_statistics_column ON object_statistics (column_name, minimum);
+            CREATE INDEX IF NOT EXISTS segment_statistics_column ON segment_statistics (column_name, minimum);
+        ''')
+        self._connection.commit()
+
+        self._object_ids = dict(self._connection.execute('SELECT object_name, object_id FROM objects'))
+        self._object_names = {object_id: object_name for object_name, object_id in self._object_ids.items()}
+        self._segment_arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._segment_arrays = {}
+        self._connection.close()
+
+    @property
+    def path_store(self):
+        return self._path_store
+
+    def runs(self):
+        return [run_id for run_id, in self._connection.execute('SELECT run_id FROM runs ORDER BY created_at')]
+
+    def opening_run(self, run_id, maximum_segment_rows=1000000):
+        '''
+        Return a ResultRunWriter to append the results of the analyses of a run.
+        '''
+        return ResultRunWriter(self, run_id, maximum_segment_rows)
+
+    def appending_results(self, run_id, results):
+        '''
+        Append the results of a run, a dictionary with the name of the list as key and its result dataframe as value.
+        '''
+        with self.opening_run(run_id) as run_writer:
+            for list_name, df in results.items():
+                run_writer.appending_result(list_name, df)
+
+    def appending_result_files(self, run_id, result_files):
+        '''
+        Append the result files of a run (written by writing_output or by batch_enrichment_analysis),
+        a dictionary with the name of the list as key and the path of its result file as value
+        (e.g. the paths of BatchJournal.finished_analyses).
+        '''
+        with self.opening_run(run_id) as run_writer:
+            for list_name, path_result in result_files.items():
+                run_writer.appending_result(list_name, pa.read_csv(path_result, sep='\t', comment='#', index_col=0))
+
+    def object_ids_creation(self, object_names):
+        '''
+        Return the IDs of the objects in the catalog, the new objects are added (the caller commits).
+        '''
+        new_objects = [object_name for object_name in dict.fromkeys(object_names) if object_name not in self._object_ids]
+        for object_name in new_objects:
+            object_id = self._connection.execute('INSERT INTO objects (object_name) VALUES (?)', (object_name,)).lastrowid
+            self._object_ids[object_name] = object_id
+            self._object_names[object_id] = object_name
+
+        return np.array([self._object_ids[object_name] for object_name in object_names], dtype=np.int64)
+
+    def writing_segment(self, run_id, results):
+        '''
+        Write the results of several lists in a new segment of the run and record it in the catalog.
+            -results: list of tuples (name of the list, array of the analyzed objects, dictionary with the name
+             of the column as key and the array of its values as value).
+        The segment is written in a temporary directory renamed when it is complete, and the catalog is updated
+        in one transaction, so a crash never leaves a partial segment in the store.
+        '''
+        columns = list(dict.fromkeys(column for _, _, list_values in results for column in list_values))
+
+        list_ids = []
+        for list_name, _, _ in results:
+            list_ids.append(self._connection.execute('INSERT INTO lists (run_id, list_name) VALUES (?, ?)', (run_id, list_name)).lastrowid)
+
+        analyzed_objects = np.concatenate([list_objects for _, list_objects, _ in results])
+        object_ids = self.object_ids_creation(analyzed_objects.tolist())
+        row_list_ids = np.repeat(np.array(list_ids, dtype=np.int64), [len(list_objects) for _, list_objects, _ in results])
+        column_values = [np.concatenate([list_values.get(column, np.full(len(list_objects), np.nan))
+                                         for _, list_objects, list_values in results]) for column in columns]
+
+        row_order = np.argsort(object_ids, kind='mergesort')
+        object_ids = object_ids[row_order]
+        row_list_ids = row_list_ids[row_order]
+        column_values = [values[row_order] for values in column_values]
+
+        segment_id = self._connection.execute('SELECT COALESCE(MAX(segment_id), 0) + 1 FROM segments').fetchone()[0]
+        segment_path = os.path.join('runs', str(run_id), 'segment_' + str(segment_id))
+        path_segment = os.path.join(self.path_store, segment_path)
+        path_temporary = path_segment + '.tmp'
+
+        # A directory without catalog entry is left by a crash before the commit of its segment.
+        shutil.rmtree(path_temporary, ignore_errors=True)
+        shutil.rmtree(path_segment, ignore_errors=True)
+        os.makedirs(path_temporary)
+        np.save(os.path.join(path_temporary, 'object_ids.npy'), object_ids)
+        np.save(os.path.join(path_temporary, 'list_ids.npy'), row_list_ids)
+        for column_number, values in enumerate(column_values):
+            np.save(os.path.join(path_temporary, 'column_' + str(column_number) + '.npy'), values)
+        os.replace(path_temporary, path_segment)
+
+        unique_object_ids, start_rows, object_counts = np.unique(object_ids, return_index=True, return_counts=True)
+
+        self._connection.execute('INSERT INTO segments VALUES (?, ?, ?, ?, ?)',
+                                 (segment_id, run_id, segment_path, len(object_ids), json.dumps(columns)))
+        self._connection.executemany('INSERT INTO object_index VALUES (?, ?, ?, ?)',
+                                     zip([segment_id] * len(unique_object_ids), unique_object_ids.tolist(),
+                                         start_rows.tolist(), (start_rows + object_counts).tolist()))
+
+        for column, values in zip(columns, column_values):
+            if len(values) == 0:
+                continue
+            object_minimums = np.fmin.reduceat(values, start_rows)
+            object_maximums = np.fmax.reduceat(values, start_rows)
+            self._connection.execute('INSERT INTO segment_statistics VALUES (?, ?, ?, ?)',
+                                     (segment_id, column, _none_if_nan(np.fmin.reduce(object_minimums).item()),
+                                      _none_if_nan(np.fmax.reduce(object_maximums).item())))
+            self._connection.executemany('INSERT INTO object_statistics VALUES (?, ?, ?, ?, ?)',
+                                         zip([segment_id] * len(unique_object_ids), unique_object_ids.tolist(), [column] * len(unique_object_ids),
+                                             map(_none_if_nan, object_minimums.tolist()), map(_none_if_nan, object_maximums.tolist())))
+
+        self._connection.execute('INSERT OR IGNORE INTO runs VALUES (?, ?)', (run_id, time.time()))
+        self._connection.commit()
+
+        logger.info('Segment %s of run %s written: %s lists, %s rows', segment_id, run_id, len(list_ids), len(object_ids))
+
+    def loading_segment_array(self, segment_path, file_name):
+        '''
+        The segments are never modified, so their memory-mapped arrays are opened once.
+        '''
+        if (segment_path, file_name) not in self._segment_arrays:
+            self._segment_arrays[(segment_path, file_name)] = np.load(os.path.join(self.path_store, segment_path, file_name), mmap_mode='r')
+
+        return self._segment_arrays[(segment_path, file_name)]
+
+    def reading_rows(self, segment_rows, column_name=None, maximum_value=None):
+        '''
+        Read the ranges of rows (segment path, columns, start row, end row) and return them in a dataframe,
+        only the rows with a value of column_name lower than maximum_value are kept.
+        '''
+        # The ranges of rows are grouped by segment, to read each column of a segment once.
+        segment_ranges = collections.OrderedDict()
+        for segment_path, columns, start_row, end_row in segment_rows:
+            segment_ranges.setdefault((segment_path, columns), []).append((start_row, end_row))
+
+        selected_values = collections.defaultdict(list)
+        number_of_selected_rows = 0
+        for (segment_path, columns), row_ranges in segment_ranges.items():
+            columns = json.loads(columns)
+
+            if column_name is not None and column_name not in columns:
+                continue
+
+            start_rows, end_rows = np.array(sorted(row_ranges), dtype=np.int64).T
+            range_lengths = end_rows - start_rows
+            selected_rows = np.repeat(start_rows - np.cumsum(range_lengths) + range_lengths, range_lengths) + \
+                np.arange(range_lengths.sum())
+            if column_name is not None:
+                values = self.loading_segment_array(segment_path, 'column_' + str(columns.index(column_name)) + '.npy')
+                selected_rows = selected_rows[values[selected_rows] < maximum_value]
+
+            segment_values = {'ListID': self.loading_segment_array(segment_path, 'list_ids.npy')[selected_rows],
+                              'ObjectID': self.loading_segment_array(segment_path, 'object_ids.npy')[selected_rows]}
+            for column_number, column in enumerate(columns):
+                segment_values[column] = self.loading_segment_array(segment_path, 'column_' + str(column_number) + '.npy')[selected_rows]
+
+            # A column missing in the previous segments is filled with NaN.
+            for column, values in segment_values.items():
+                if column not in selected_values and number_of_selected_rows > 0:
+                    selected_values[column].append(np.full(number_of_selected_rows, np.nan))
+                selected_values[column].append(values)
+            number_of_selected_rows += len(segment_values['ListID'])
+            for column in selected_values:
+                if column not in segment_values:
+                    selected_values[column].append(np.full(len(segment_values['ListID']), np.nan))
+
+        if selected_values == {}:
+            return pa.DataFrame(columns=['RunID', 'ListName', 'AnalyzedObject'])
+
+        df = pa.DataFrame({column: np.concatenate(values) for column, values in selected_values.items()})
+
+        # The names are mapped on the unique ids and then spread on the rows.
+        list_ids, list_positions = np.unique(df['ListID'].values, return_inverse=True)
+        list_ids = list_ids.tolist()
+        list_names = {}
+        for list_ids_chunk in [list_ids[chunk_start:chunk_start + 500] for chunk_start in range(0, len(list_ids), 500)]:
+            list_names.update({list_id: (run_id, list_name) for list_id, run_id, list_name in
+                               self._connection.execute('SELECT list_id, run_id, list_name FROM lists WHERE list_id IN (' +
+                                                        ','.join('?' * len(list_ids_chunk)) + ')', list_ids_chunk)})
+        object_ids, object_positions = np.unique(df['ObjectID'].values, return_inverse=True)
+
+        df.insert(0, 'RunID', np.array([list_names[list_id][0] for list_id in list_ids], dtype=object)[list_positions])
+        df.insert(1, 'ListName', np.array([list_names[list_id][1] for list_id in list_ids], dtype=object)[list_positions])
+        df.insert(2, 'AnalyzedObject', np.array([self._object_names[object_id] for object_id in object_ids.tolist()],
+                                                dtype=object)[object_positions])
+
+        return df.drop(['ListID', 'ObjectID'], axis=1)
+
+    def querying_object(self, analyzed_object, column_name=None, maximum_value=None, run_ids=None):
+        '''
+        Return the results of an object (e.g. a GO term) in all the stored lists (or in the lists of run_ids),
+        with column_name and maximum_value only the results with a value lower than maximum_value.
+        The object index gives the rows of the object in each segment, and the segments where the minimum
+        of the object is not lower than maximum_value are not read.
+        '''
+        if analyzed_object not in self._object_ids:
+            return self.reading_rows([])
+
+        query = 'SELECT segments.path, segments.columns, object_index.start_row, object_index.end_row FROM object_index ' \
+                'JOIN segments ON segments.segment_id = object_index.segment_id'
+        parameters = [self._object_ids[analyzed_object]]
+        if column_name is not None:
+            query += ' JOIN object_statistics ON object_statistics.segment_id = object_index.segment_id ' \
+                     'AND object_statistics.object_id = object_index.object_id AND object_statistics.column_name = ? ' \
+                     'AND object_statistics.minimum < ?'
+            parameters = [column_name, maximum_value] + parameters
+        query += ' WHERE object_index.object_id = ?'
+        if run_ids is not None:
+            query += ' AND segments.run_id IN (' + ','.join('?' * len(run_ids)) + ')'
+            parameters += list(run_ids)
+
+        return self.reading_rows(self._connection.execute(query, parameters).fetchall(), column_name, maximum_value)
+
+    def querying_threshold(self, column_name, maximum_value, run_ids=None):
+        '''
+        Return the results of all the objects with a value of column_name lower than maximum_value.
+        Only the ranges of rows of the objects whose minimum in the segment is lower than maximum_value are read,
+        so a threshold passed by many objects in every segment still reads most of the column.
+        '''
+        query = 'SELECT segments.path, segments.columns, object_index.start_row, object_index.end_row ' \
+                'FROM object_statistics JOIN object_index ON object_index.segment_id = object_statistics.segment_id ' \
+                'AND object_index.object_id = object_statistics.object_id ' \
+                'JOIN segments ON segments.segment_id = object_statistics.segment_id ' \
+                'WHERE object_statistics.column_name = ? AND object_statistics.minimum < ?'
+        parameters = [column_name, maximum_value]
+        if run_ids is not None:
+            query += ' AND segments.run_id IN (' + ','.join('?' * len(run_ids)) + ')'
+            parameters += list(run_ids)
+
+        return self.reading_rows(self._connection.execute(query, parameters).fetchall(), column_name, maximum_value)
+
+class ResultRunWriter():
+    '''
+    Append the results of the analyses of a run to an EnrichmentResultStore.
+    The results are kept in memory and written in a new segment when maximum_segment_rows rows are reached
+    and when the writer is closed. Only the numeric columns are stored.
+    '''
+    def __init__(self, result_store, run_id, maximum_segment_rows=1000000):
+        self._result_store = result_store
+        self._run_id = run_id
+        self._maximum_segment_rows = maximum_segment_rows
+        self._results = []
+        self._number_of_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    @property
+    def run_id(self):
+        return self._run_id
+
+    def appending_result(self, list_name, df):
+        list_values = {column: df[column].values.astype(float) for column, column_type in df.dtypes.items()
+                       if np.issubdtype(column_type, np.number)}
+        self._results.append((list_name, np.asarray(df.index, dtype=object), list_values))
+        self._number_of_rows += len(df.index)
+
+        if self._number_of_rows >= self._maximum_segment_rows:
+            self.flushing()
+
+    def flushing(self):
+        if self._results != []:
+            self._result_store.writing_segment(self.run_id, self._results)
+        self._results = []
+        self._number_of_rows = 0
+
+    def close(self):
+        self.flushing()
+
+
+def _none_if_nan(value):
+    return None if value != value else value
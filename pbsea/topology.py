@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import numpy as np
+import pandas as pa
+import scipy.stats as stats
+
+from functools import reduce
+
+from pbsea.pbsea import AnnotationEnrichmentAnalysis
+
+logger = logging.getLogger(__name__)
+
+
+def topological_order(object_parents, analyzed_objects):
+    '''
+    Return the objects and all their ancestors (using the object_parents dictionary, object as key
+    and list of parents as value) sorted from the leaves to the roots: an object is always after all its children.
+    '''
+    objects_in_graph = set()
+    objects_to_visit = list(analyzed_objects)
+    while objects_to_visit:
+        analyzed_object = objects_to_visit.pop()
+        if analyzed_object not in objects_in_graph:
+            objects_in_graph.add(analyzed_object)
+            objects_to_visit.extend(object_parents.get(analyzed_object, []))
+
+    number_of_children = dict.fromkeys(objects_in_graph, 0)
+    for analyzed_object in objects_in_graph:
+        for parent in object_parents.get(analyzed_object, []):
+            number_of_children[parent] += 1
+
+    sorted_objects = []
+    objects_without_children = collections.deque(sorted(analyzed_object for analyzed_object in objects_in_graph
+                                                         if number_of_children[analyzed_object] == 0))
+    while objects_without_children:
+        analyzed_object = objects_without_children.popleft()
+        sorted_objects.append(analyzed_object)
+        for parent in object_parents.get(analyzed_object, []):
+            number_of_children[parent] -= 1
+            if number_of_children[parent] == 0:
+                objects_without_children.append(parent)
+
+    if len(sorted_objects) != len(objects_in_graph):
+        raise ValueError("The graph of the objects contains a cycle.")
+
+    return sorted_objects
+
+
+class TopologyEnrichmentAnalysis(AnnotationEnrichmentAnalysis):
+    '''
+    Annotation Enrichment Analysis taking into account the topology of the Gene Ontology graph
+    (Alexa et al. 2006, Bioinformatics 22:1600 and Grossmann et al. 2007, Bioinformatics 23:3024).
+    Tests on each GO term separately flag all the ancestors of a significant term, these algorithms
+    decorrelate the tests of a term and of its ancestors:
+        -elim: the terms are tested from the leaves to the roots and the genes of a significant term
+         (pvalue lower than elim_cutoff) are removed from all its ancestors.
+        -weight: a term and its children are compared in both directions with the ratio of their pvalues:
+         the genes of a more significant child are down-weighted in the term and the genes of the children
+         of a more significant term are down-weighted in the children (see compute_weight).
+        -parent_child: a term is tested against the genes of its parents instead of all the genes
+         (union or intersection of the parents with parent_child_method).
+    The genes of a term are propagated to its ancestors (true path rule) and each term is represented by
+    the sorted array of its genes, the removed genes and the weights are arrays aligned on it.
+    This class takes these new attributes:
+        -gene_sets: dictionary containing the GO terms as key and their set of genes as value.
+        -object_parents: dictionary containing the GO terms as key and the list of their parents as value
+         (it can be created with go_parents_dictionary_creation).
+        -interest_genes: the list of genes of interest.
+    '''
+    def __init__(self, gene_sets, object_parents, interest_genes, alpha, annotation_label_to_numbers,
+                 annotation_category, algorithm='elim', elim_cutoff=0.01, parent_child_method='union'):
+        if algorithm not in ['elim', 'weight', 'parent_child']:
+            raise ValueError("The algorithm must be 'elim', 'weight' or 'parent_child'.")
+        if parent_child_method not in ['union', 'intersection']:
+            raise ValueError("The parent_child_method must be 'union' or 'intersection'.")
+
+        self._algorithm = algorithm
+        self._elim_cutoff = elim_cutoff
+        self._parent_child_method = parent_child_method
+        self._object_parents = object_parents
+
+        self._sorted_objects = topological_order(object_parents, gene_sets)
+
+        genes = sorted(set().union(*gene_sets.values()))
+        gene_to_index = {gene: gene_index for gene_index, gene in enumerate(genes)}
+        self._interest_mask = np.zeros(len(genes), dtype=bool)
+        self._interest_mask[[gene_to_index[gene] for gene in set(interest_genes) if gene in gene_to_index]] = True
+
+        self._object_genes = self.propagation_gene_sets(gene_sets, gene_to_index)
+
+        object_sizes = {analyzed_object: len(object_genes) for analyzed_object, object_genes in self._object_genes.items()}
+        interest_counts = {analyzed_object: int(self._interest_mask[object_genes].sum())
+                           for analyzed_object, object_genes in self._object_genes.items()}
+
+        dataframe = pa.DataFrame({'Counts': pa.Series(interest_counts), 'CountsReference': pa.Series(object_sizes)},
+                                 columns=['Counts', 'CountsReference'])
+        dataframe = dataframe[dataframe['Counts'] > 0].sort_index()
+        dataframe.index.name = annotation_category
+
+        AnnotationEnrichmentAnalysis.__init__(self, dataframe, 'Counts', 'CountsReference',
+                 int(self._interest_mask.sum()), len(genes), alpha, np.inf, annotation_label_to_numbers,
+                 annotation_category)
+
+    @property
+    def algorithm(self):
+        return self._algorithm
+
+    @property
+    def elim_cutoff(self):
+        return self._elim_cutoff
+
+    def propagation_gene_sets(self, gene_sets, gene_to_index):
+        '''
+        Add the genes of each term to all its ancestors, from the leaves to the roots.
+        Return a dictionary with the terms as key and the sorted array of their gene indexes as value.
+        '''
+        children_genes = collections.defaultdict(list)
+        object_genes = {}
+
+        for analyzed_object in self._sorted_objects:
+            own_genes = np.array([gene_to_index[gene] for gene in gene_sets.get(analyzed_object, [])], dtype=np.int64)
+            object_genes[analyzed_object] = np.unique(np.concatenate([own_genes] + children_genes.pop(analyzed_object, [])))
+            for parent in self._object_parents.get(analyzed_object, []):
+                children_genes[parent].append(object_genes[analyzed_object])
+
+        return object_genes
+
+    def test_on_dataframe(self, df):
+        self.statistic_method = 'pvalue_' + self.algorithm
+        self.output_columns[4] = self.statistic_method
+
+        if self.algorithm == 'elim':
+            pvalues = self.compute_elim()
+        elif self.algorithm == 'weight':
+            pvalues = self.compute_weight()
+        elif self.algorithm == 'parent_child':
+            pvalues = self.compute_parent_child()
+
+        df[self.statistic_method] = pa.Series(pvalues).reindex(df.index)
+        df = df.sort_values(self.statistic_method)
+
+        return df
+
+    def hypergeometric_test_cache(self):
+        '''
+        Return a function computing the hypergeometric tail for the whole population, memoized on the two
+        counts because many terms share the same counts (and the terms without gene of interest are not tested).
+        '''
+        tails = {}
+
+        def hypergeometric_tail(number_of_object_in_interest, number_of_object_in_reference):
+            if number_of_object_in_interest == 0:
+                return 1.0
+            counts = (number_of_object_in_interest, number_of_object_in_reference)
+            if counts not in tails:
+                tails[counts] = stats.hypergeom.sf(number_of_object_in_interest - 1, self.number_of_analyzed_object_of_reference,
+                                                   number_of_object_in_reference, self.number_of_analyzed_object_of_interest)
+            return tails[counts]
+
+        return hypergeometric_tail
+
+    def compute_elim(self):
+        hypergeometric_tail = self.hypergeometric_test_cache()
+        removed_genes = {analyzed_object: np.zeros(len(object_genes), dtype=bool) for analyzed_object, object_genes in self._object_genes.items()}
+        pvalues = {}
+
+        for analyzed_object in self._sorted_objects:
+            object_genes = self._object_genes[analyzed_object]
+            remaining_genes = object_genes[~removed_genes[analyzed_object]]
+
+            pvalues[analyzed_object] = hypergeometric_tail(int(self._interest_mask[remaining_genes].sum()), len(remaining_genes))
+
+            if pvalues[analyzed_object] < self.elim_cutoff:
+                genes_to_remove = object_genes
+            else:
+                genes_to_remove = object_genes[removed_genes[analyzed_object]]
+
+            if len(genes_to_remove) > 0:
+                for parent in self._object_parents.get(analyzed_object, []):
+                    removed_genes[parent][np.searchsorted(self._object_genes[parent], genes_to_remove)] = True
+
+        return pvalues
+
+    def compute_weight(self):
+        '''
+        Weight algorithm of topGO: each term is compared to its children with the ratio of their pvalues,
+        from the leaves to the roots.
+            -if children are more significant than the term, their genes are down-weighted in the term
+             (multiplied by the ratio), the term is tested again and compared to its other children, until
+             no remaining child is more significant.
+            -if the term is more significant than all its (remaining) children, the genes of the children
+             are down-weighted in the children (divided by the ratio) and the children are tested again.
+        The weights of the genes of a term are then propagated to its parents.
+        '''
+        hypergeometric_tail = self.hypergeometric_test_cache()
+        gene_weights = {analyzed_object: np.ones(len(object_genes)) for analyzed_object, object_genes in self._object_genes.items()}
+        object_children = collections.defaultdict(list)
+        pvalues = {}
+
+        def weighted_test(analyzed_object):
+            object_genes, weights = self._object_genes[analyzed_object], gene_weights[analyzed_object]
+            return hypergeometric_tail(int(np.rint(weights[self._interest_mask[object_genes]].sum())), int(np.rint(weights.sum())))
+
+        # The pvalues are bounded by the smallest float, so the ratio of two null pvalues is 1.
+        significance_ratio = lambda child_pvalue, pvalue: max(child_pvalue, np.finfo(float).tiny) / max(pvalue, np.finfo(float).tiny)
+
+        for analyzed_object in self._sorted_objects:
+            object_genes = self._object_genes[analyzed_object]
+            weights = gene_weights[analyzed_object]
+
+            pvalue = weighted_test(analyzed_object)
+            children = object_children[analyzed_object]
+            while children != []:
+                ratios = {child: significance_ratio(pvalues[child], pvalue) for child in children}
+
+                if all(ratio > 1 for ratio in ratios.values()):
+                    for child in children:
+                        gene_weights[child] /= ratios[child]
+                        pvalues[child] = weighted_test(child)
+                    break
+
+                for child in children:
+                    if ratios[child] <= 1:
+                        weights[np.searchsorted(object_genes, self._object_genes[child])] *= ratios[child]
+                children = [child for child in children if ratios[child] > 1]
+                pvalue = weighted_test(analyzed_object)
+            pvalues[analyzed_object] = pvalue
+
+            for parent in self._object_parents.get(analyzed_object, []):
+                object_children[parent].append(analyzed_object)
+
+            if (weights < 1).any():
+                for parent in self._object_parents.get(analyzed_object, []):
+                    positions = np.searchsorted(self._object_genes[parent], object_genes)
+                    gene_weights[parent][positions] = np.minimum(gene_weights[parent][positions], weights)
+
+        return pvalues
+
+    def compute_parent_child(self):
+        analyzed_objects = self._sorted_objects
+        interest_counts = []
+        reference_counts = []
+        parent_interest_counts = []
+        parent_reference_counts = []
+
+        for analyzed_object in analyzed_objects:
+            object_genes = self._object_genes[analyzed_object]
+            parents = self._object_parents.get(analyzed_object, [])
+            if parents == []:
+                parent_genes = np.arange(len(self._interest_mask))
+            elif self._parent_child_method == 'union':
+                parent_genes = reduce(np.union1d, [self._object_genes[parent] for parent in parents])
+            elif self._parent_child_method == 'intersection':
+                parent_genes = reduce(np.intersect1d, [self._object_genes[parent] for parent in parents])
+
+            interest_counts.append(self._interest_mask[object_genes].sum())
+            reference_counts.append(len(object_genes))
+            parent_interest_counts.append(self._interest_mask[parent_genes].sum())
+            parent_reference_counts.append(len(parent_genes))
+
+        interest_counts = np.array(interest_counts)
+        pvalues = stats.hypergeom.sf(interest_counts - 1, parent_reference_counts, reference_counts, parent_interest_counts)
+        pvalues[interest_counts == 0] = 1
+
+        return dict(zip(analyzed_objects, pvalues))
@@ -0,0 +1,102 @@
+import os
+import pandas as pa
+import tempfile
+import unittest
+
+from pbsea import BatchJournal, EnrichmentReference, ReferenceSnapshot, batch_enrichment_analysis, enrichment_analysis_on_reference, \
+                  manifest_creation, reference_snapshot_creation, write_reference_snapshot
+from pbsea.batch import _opened_references, _opening_reference
+
+test_data_directory = 'test_data/'
+test_data_directory_annotation = test_data_directory + 'test_annotation/'
+
+class batchEnrichmentAnalysis_test(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.path_snapshot = os.path.join(self.temporary_directory.name, 'reference.snapshot')
+        reference_snapshot_creation('Genes', 'GOs', test_data_directory_annotation + 'genes_annotation.tsv', self.path_snapshot)
+        self.output_directory = os.path.join(self.temporary_directory.name, 'results')
+        self.manifest = {'list_1': ['Gene_1', 'Gene_2', 'Gene_3'], 'list_2': ['Gene_4', 'Gene_5'], 'list_3': ['Gene_2', 'Gene_6', 'Gene_7']}
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_batch_enrichment_analysis(self):
+        print("\nTesting batch enrichment analysis ")
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.05, 10000,
+                                                    number_of_workers=2)
+
+        self.assertEqual(analysis_status, {'list_1': 'done', 'list_2': 'done', 'list_3': 'done'})
+        self.assertEqual(sorted(os.listdir(self.output_directory)),
+                         ['journal.sqlite', 'results_list_1_over.tsv', 'results_list_2_over.tsv', 'results_list_3_over.tsv'])
+
+        with ReferenceSnapshot(self.path_snapshot) as snapshot:
+            reference = EnrichmentReference.from_snapshot(snapshot)
+            interest_counts, number_of_genes_found = reference.counting_objects_in_interest(self.manifest['list_1'])
+            df_expected, significative_objects = enrichment_analysis_on_reference(reference, interest_counts, number_of_genes_found, 0.05, 10000)
+            del reference, interest_counts
+
+        df_result = pa.read_csv(os.path.join(self.output_directory, 'results_list_1_over.tsv'), sep='\t', comment='#', index_col=0)
+        self.assertEqual(sorted(df_result.index), sorted(df_expected.index))
+        self.assertAlmostEqual(df_result['pValueBenjaminiHochberg'].min(), df_expected['pValueBenjaminiHochberg'].min(), places=6)
+
+    def test_unannotated_list(self):
+        print("\nTesting batch with a list without annotated gene ")
+        self.manifest['list_4'] = ['Gene_unknown']
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.05, 10000)
+        self.assertEqual(analysis_status['list_4'], 'done')
+
+        df_result = pa.read_csv(os.path.join(self.output_directory, 'results_list_4_over.tsv'), sep='\t', comment='#', index_col=0)
+        self.assertEqual(len(df_result.index), 0)
+
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.05, 10000)
+        self.assertEqual(set(analysis_status.values()), {'skipped'})
+
+    def test_resuming_batch(self):
+        print("\nTesting resuming of a batch with the journal ")
+        first_manifest = {list_name: self.manifest[list_name] for list_name in ['list_1', 'list_2']}
+        batch_enrichment_analysis(self.path_snapshot, first_manifest, self.output_directory, 0.05, 10000)
+
+        # A changed list and a removed result file are analyzed again, the other finished lists are skipped.
+        os.remove(os.path.join(self.output_directory, 'results_list_2_over.tsv'))
+        self.manifest['list_1'] = ['Gene_1', 'Gene_2']
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.05, 10000,
+                                                    number_of_workers=2, executor_type='process')
+        self.assertEqual(analysis_status, {'list_1': 'done', 'list_2': 'done', 'list_3': 'done'})
+
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.05, 10000)
+        self.assertEqual(analysis_status, {'list_1': 'skipped', 'list_2': 'skipped', 'list_3': 'skipped'})
+
+        analysis_status = batch_enrichment_analysis(self.path_snapshot, self.manifest, self.output_directory, 0.01, 10000)
+        self.assertEqual(set(analysis_status.values()), {'done'})
+
+        with BatchJournal(os.path.join(self.output_directory, 'journal.sqlite')) as journal:
+            finished_analyses = journal.finished_analyses()
+        self.assertEqual(sorted(finished_analyses), ['list_1', 'list_2', 'list_3'])
+        self.assertEqual(finished_analyses['list_3'][1], os.path.join(self.output_directory, 'results_list_3_over.tsv'))
+
+    def test_opening_rewritten_snapshot(self):
+        print("\nTesting opening of a rewritten snapshot ")
+        first_reference = _opening_reference(self.path_snapshot)
+        self.assertIs(_opening_reference(self.path_snapshot), first_reference)
+        number_of_opened_references = len(_opened_references)
+
+        # Only the last version of a snapshot is kept, the previous reference can still be used.
+        write_reference_snapshot(self.path_snapshot, {'GO:1': {'Gene_1', 'Gene_2'}, 'GO:2': {'Gene_2'}})
+        second_reference = _opening_reference(self.path_snapshot)
+        self.assertIsNot(second_reference, first_reference)
+        self.assertEqual(len(_opened_references), number_of_opened_references)
+        self.assertEqual(second_reference.counting_objects_in_interest(['Gene_2'])[0].to_dict(), {'GO:1': 1, 'GO:2': 1})
+        self.assertGreater(first_reference.counting_objects_in_interest(self.manifest['list_1'])[1], 0)
+
+    def test_manifest_creation(self):
+        print("\nTesting manifest creation ")
+        path_manifest = os.path.join(self.temporary_directory.name, 'manifest.tsv')
+        with open(path_manifest, 'w') as manifest_file:
+            manifest_file.write('ListName\tPath\nlist_1\t' + os.path.abspath(test_data_directory_annotation + 'genes_interest.tsv') + '\n')
+
+        self.assertEqual(manifest_creation(path_manifest, 'Genes'), {'list_1': ['Gene_1', 'Gene_2', 'Gene_3']})
+
+if __name__ == '__main__':
+    unittest.main()
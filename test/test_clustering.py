@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pa
+import unittest
+
+from pbsea import functional_annotation_clustering, incidence_matrix_creation, kappa_similarity
+
+
+class functionalAnnotationClustering_test(unittest.TestCase):
+
+    def setUp(self):
+        self.gene_sets = {'GO:0000001': {'g1', 'g2', 'g3', 'g4'},
+                          'GO:0000002': {'g1', 'g2', 'g3', 'g4', 'g5'},
+                          'GO:0000003': {'g1', 'g2', 'g3'},
+                          'GO:0000004': {'g10', 'g11', 'g12'},
+                          'GO:0000005': {'g10', 'g11', 'g12', 'g13'},
+                          'GO:0000006': {'g10', 'g11', 'g13'},
+                          'GO:0000007': {'g20'}}
+
+    def test_kappa_similarity(self):
+        '''
+        Kappa computed by hand for two objects sharing 3 genes (sizes 4 and 3) on 20 genes:
+        observed agreement = 19/20, chance agreement = (12 + 16 * 17) / 400.
+        '''
+        print("\nTesting kappa similarity ")
+        incidence_matrix, analyzed_objects, genes = incidence_matrix_creation(self.gene_sets, ['GO:0000001', 'GO:0000003', 'GO:0000007'])
+        kappas = kappa_similarity(incidence_matrix, 20).toarray()
+
+        chance_agreement = (12 + 16 * 17) / 400
+        np.testing.assert_almost_equal(kappas[0, 1], (19 / 20 - chance_agreement) / (1 - chance_agreement))
+        self.assertEqual(kappas[0, 2], 0)
+        self.assertEqual(kappas[0, 0], 0)
+
+    def test_functional_annotation_clustering(self):
+        print("\nTesting functional annotation clustering ")
+        df = pa.DataFrame({'pvalue_hypergeometric': [0.001, 0.002, 0.003, 0.0001, 0.0002, 0.0003, 0.01]},
+                          index=pa.Index(sorted(self.gene_sets), name='GOs'))
+
+        df_clusters = functional_annotation_clustering(df, self.gene_sets, 20)
+
+        self.assertEqual(df_clusters[df_clusters['Cluster'] == 1].index.tolist(), ['GO:0000004', 'GO:0000005', 'GO:0000006'])
+        self.assertEqual(df_clusters[df_clusters['Cluster'] == 2].index.tolist(), ['GO:0000001', 'GO:0000002', 'GO:0000003'])
+        self.assertNotIn('GO:0000007', df_clusters.index)
+        np.testing.assert_almost_equal(df_clusters['EnrichmentScore'].iloc[0], -np.log10([0.0001, 0.0002, 0.0003]).mean())
+
+if __name__ == '__main__':
+    unittest.main()
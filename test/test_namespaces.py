@@ -0,0 +1,42 @@
+import numpy as np
+import unittest
+
+from pbsea import PandasBasedEnrichmentAnalysis, counting_objects, multiple_namespaces_enrichment_analysis
+
+test_data_directory = 'test_data/'
+test_data_directory_annotation = test_data_directory + 'test_annotation/'
+
+class multipleNamespaces_test(unittest.TestCase):
+
+    def setUp(self):
+        self.file_interest = test_data_directory_annotation + 'genes_interest.tsv'
+        self.file_reference = test_data_directory_annotation + 'genes_annotation.tsv'
+        self.namespaces = ['GOs', 'ECs', 'InterPros']
+
+    def test_correction_by_namespace(self):
+        print("\nTesting multiple namespaces analysis with corrections by namespace ")
+        df, significative_objects = multiple_namespaces_enrichment_analysis('Genes', self.namespaces, self.file_interest,
+                                                                            self.file_reference, 3, 8, 0.05, 10000)
+
+        for namespace in self.namespaces:
+            df_int, df_ref = counting_objects('Genes', namespace, self.file_interest, self.file_reference)
+            analysis = PandasBasedEnrichmentAnalysis(df_int.join(df_ref), 'count_int', 'count_ref', 3, 8, 0.05, 10000)
+            df_namespace, significative_objects_namespace = analysis.compute_enrichment()
+
+            df_result_namespace = df[df['Namespace'] == namespace]
+            self.assertEqual(df_result_namespace.index.tolist(), df_namespace.index.tolist())
+            np.testing.assert_array_almost_equal(df_result_namespace['pValueBenjaminiHochberg'], df_namespace['pValueBenjaminiHochberg'])
+            self.assertEqual(significative_objects[namespace], significative_objects_namespace)
+
+    def test_global_correction(self):
+        print("\nTesting multiple namespaces analysis with global corrections ")
+        df, significative_objects = multiple_namespaces_enrichment_analysis('Genes', self.namespaces, self.file_interest,
+                                                                            self.file_reference, 3, 8, 0.05, 10000,
+                                                                            correction_scope='global')
+
+        self.assertEqual(len(df.index), 6)
+        np.testing.assert_array_almost_equal(df['pValueBonferroni'], np.minimum(df['pvalue_hypergeometric'] * 6, 1))
+        self.assertEqual(sorted(significative_objects), sorted(self.namespaces))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,11 @@ import numpy as np
 import os
 import pandas as pa
 import scipy.stats as stats
+import tempfile
+import threading
 import unittest
 
-from pbsea import PandasBasedEnrichmentAnalysis, EnrichmentAnalysisExperimental, preprocessing_files
+from pbsea import PandasBasedEnrichmentAnalysis, EnrichmentAnalysisExperimental, AnalysisCancelled, preprocessing_files, identical_gene_sets_grouping
 from unittest.mock import patch
 
 test_data_directory = 'test_data/'
@@ -73,6 +75,159 @@ class enrichmentAnalysis_test(unittest.TestCase):
         np.testing.assert_array_almost_equal(df_joined_wih_results['pvalue_normal'].tolist(),
                                              df_joined['pvalue_normal_approximation'].tolist(), decimal = 4)
 
+    def test_parallel_test_on_dataframe(self):
+        print("\nTesting pvalues computed in chunks by a pool of workers ")
+        df_serial = self.obj.test_on_dataframe(self.obj.dataframe.copy())
+
+        for executor_type in ['process', 'thread']:
+            self.obj.number_of_workers = 2
+            self.obj.chunk_size = 2
+            self.obj.executor_type = executor_type
+            df_parallel = self.obj.test_on_dataframe(self.obj.dataframe.copy())
+
+            pa.testing.assert_frame_equal(df_parallel, df_serial)
+
+    def test_tarone_pruning(self):
+        '''
+        Datas have been created for the example: 20 objects present once in the reference (minimum achievable
+        pvalue of 10 / 1000 = 0.01) and 3 objects which can reach a lower pvalue.
+        The smallest number of tests k with at most k objects having a minimum pvalue lower than 0.05 / k is 6,
+        so only the 3 last objects are testable.
+        '''
+        print("\nTesting Tarone pruning of untestable objects ")
+        df = pa.DataFrame({'Counts': [1] * 20 + [2, 3, 5], 'CountsReference': [1] * 20 + [2, 3, 5]},
+                          index=['Object_' + str(number) for number in range(23)])
+        analysis = PandasBasedEnrichmentAnalysis(df, 'Counts', 'CountsReference', 10, 1000, 0.05, 10000)
+
+        np.testing.assert_array_almost_equal(analysis.minimum_achievable_pvalues(df)[:2], [0.01, 0.01])
+
+        analysis.tarone_pruning = True
+        df_result, significative_objects = analysis.compute_enrichment()
+
+        self.assertEqual(analysis.number_of_pruned_objects, 20)
+        self.assertEqual(sorted(df_result.index.tolist()), ['Object_20', 'Object_21', 'Object_22'])
+        np.testing.assert_array_almost_equal(df_result['pValueBonferroni'], df_result['pvalue_hypergeometric'] * 3)
+
+        # No object is testable: the result is empty, without significative objects.
+        df = pa.DataFrame({'Counts': [1, 1], 'CountsReference': [900, 950]}, index=['Object_1', 'Object_2'])
+        for analysis_class in [PandasBasedEnrichmentAnalysis, EnrichmentAnalysisExperimental]:
+            analysis = analysis_class(df, 'Counts', 'CountsReference', 2, 1000, 0.05, 10000)
+            analysis.tarone_pruning = True
+            df_result, significative_objects = analysis.compute_enrichment()
+
+            self.assertEqual(analysis.number_of_pruned_objects, 2)
+            self.assertEqual(len(df_result.index), 0)
+            self.assertEqual(list(significative_objects), analysis.multiple_test_names)
+            self.assertEqual(set(map(tuple, significative_objects.values())), {()})
+
+    def test_collapsing_identical_objects(self):
+        '''
+        Datas have been created for the example: GO:2 and GO:3 annotate the same genes as GO:1.
+        '''
+        print("\nTesting collapsing of objects with identical gene sets ")
+        gene_sets = {'GO:1': {'Gene_1', 'Gene_2', 'Gene_3'}, 'GO:2': {'Gene_3', 'Gene_2', 'Gene_1'}, 'GO:3': {'Gene_1', 'Gene_2', 'Gene_3'},
+                     'GO:4': {'Gene_1', 'Gene_4'}, 'GO:5': {'Gene_5'}}
+        identical_objects = identical_gene_sets_grouping(gene_sets)
+        self.assertEqual(identical_objects, {'GO:1': 'GO:1', 'GO:2': 'GO:1', 'GO:3': 'GO:1', 'GO:4': 'GO:4', 'GO:5': 'GO:5'})
+
+        df = pa.DataFrame({'Counts': [3, 3, 3, 1, 1], 'CountsReference': [3, 3, 3, 2, 1]}, index=sorted(gene_sets))
+        analysis = PandasBasedEnrichmentAnalysis(df, 'Counts', 'CountsReference', 5, 100, 0.05, 10000)
+        df_all, significative_objects_all = analysis.compute_enrichment()
+
+        analysis.identical_objects = identical_objects
+        df_collapsed, significative_objects_collapsed = analysis.compute_enrichment()
+
+        self.assertEqual(analysis.number_of_collapsed_objects, 2)
+        self.assertEqual(df_collapsed['IdenticalGeneSet'].to_dict(), identical_objects)
+        pa.testing.assert_frame_equal(df_collapsed.drop('IdenticalGeneSet', axis=1).sort_index(), df_all.sort_index())
+        self.assertEqual(significative_objects_collapsed, significative_objects_all)
+
+        analysis.correction_on_unique_gene_sets = True
+        df_unique, significative_objects_unique = analysis.compute_enrichment()
+
+        self.assertEqual(sorted(df_unique.index), sorted(gene_sets))
+        np.testing.assert_array_almost_equal(df_unique['pValueBonferroni'], np.minimum(df_unique['pvalue_hypergeometric'] * 3, 1))
+        self.assertEqual(sorted(significative_objects_unique['Bonferroni']), ['GO:1', 'GO:2', 'GO:3'])
+
+    def test_lazy_enrichment(self):
+        print("\nTesting lazy computation of the multiple testing corrections ")
+        df_eager, significative_objects_eager = self.class_sgof_test.compute_enrichment()
+
+        lazy_result = self.class_sgof_test.compute_lazy_enrichment()
+        self.assertNotIn('pValueBenjaminiHochberg', lazy_result.dataframe.columns)
+
+        pa.testing.assert_series_equal(lazy_result.adjusted_pvalues('BenjaminiHochberg').sort_index(), df_eager['pValueBenjaminiHochberg'].sort_index())
+        self.assertEqual(lazy_result.significative_objects('Bonferroni'), significative_objects_eager['Bonferroni'])
+        self.assertEqual(sorted(lazy_result.dataframe.columns),
+                         sorted(['Counts', 'CountsReference', 'PercentageInInterest', 'PercentageInReference', 'pvalue_hypergeometric',
+                                 'pValueBenjaminiHochberg', 'pValueBonferroni']))
+        self.assertIs(lazy_result.significative_objects('Bonferroni'), lazy_result.significative_objects('Bonferroni'))
+        self.assertRaises(ValueError, lazy_result.adjusted_pvalues, 'Sidak')
+
+        df_lazy, significative_objects_lazy = lazy_result.results()
+        pa.testing.assert_frame_equal(df_lazy[df_eager.columns].sort_index(), df_eager.sort_index())
+        self.assertEqual(significative_objects_lazy, significative_objects_eager)
+
+        # The selections do not modify the shared dataframe, so the order of the accesses does not matter.
+        lazy_result = self.class_sgof_test.compute_lazy_enrichment()
+        for multiple_test_name in ['SGoF', 'Bonferroni', 'Holm', 'BenjaminiHochberg']:
+            self.assertEqual(lazy_result.significative_objects(multiple_test_name), significative_objects_eager[multiple_test_name])
+        self.assertEqual(lazy_result.dataframe['pvalue_hypergeometric'].dtype, float)
+
+        progress = []
+        self.obj.progress_callback = lambda stage, work_done, total_work: progress.append((stage, work_done, total_work))
+        self.obj.required_multiple_tests = ['BenjaminiHochberg']
+        df_required, significative_objects_required = self.obj.compute_enrichment()
+
+        self.assertEqual(list(significative_objects_required), ['BenjaminiHochberg'])
+        self.assertNotIn('pValueHolm', df_required.columns)
+        self.assertEqual([progress_step for progress_step in progress if progress_step[0] == 'correction'], [('correction', 1, 1)])
+
+        with self.assertRaises(ValueError):
+            self.obj.required_multiple_tests = ['Storey']
+
+    def test_progress_and_cancellation(self):
+        print("\nTesting progress reporting and cancellation of the analysis ")
+        df_serial, significative_objects_serial = self.obj.compute_enrichment()
+
+        progress = []
+        self.obj.chunk_size = 7
+        self.obj.progress_callback = lambda stage, work_done, total_work: progress.append((stage, work_done, total_work))
+        df_chunks, significative_objects_chunks = self.obj.compute_enrichment()
+
+        pa.testing.assert_frame_equal(df_chunks, df_serial)
+        self.assertEqual(significative_objects_chunks, significative_objects_serial)
+
+        number_of_objects = len(self.obj.dataframe.index)
+        test_progress = [work_done for stage, work_done, total_work in progress if stage == 'test']
+        self.assertEqual(len(test_progress), -(-number_of_objects // 7))
+        self.assertEqual(test_progress[-1], number_of_objects)
+        self.assertEqual([work_done for stage, work_done, total_work in progress if stage == 'correction'], [1, 2, 3, 4])
+
+        cancellation_event = threading.Event()
+        self.obj.cancellation_event = cancellation_event
+        self.obj.progress_callback = lambda stage, work_done, total_work: cancellation_event.set()
+        self.assertRaises(AnalysisCancelled, self.obj.compute_enrichment)
+
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            current_directory = os.getcwd()
+            os.chdir(temporary_directory)
+            try:
+                cancellation_event.clear()
+                self.obj.progress_callback = None
+                self.obj.writing_output(df_serial.copy(), significative_objects_serial)
+                self.assertEqual(sorted(os.listdir('.')), ['results_annotation_over.tsv', 'results_significatives_over.tsv'])
+                with open('results_annotation_over.tsv') as result_file:
+                    self.assertEqual(len(result_file.readlines()), number_of_objects + 2)
+
+                os.remove('results_annotation_over.tsv')
+                os.remove('results_significatives_over.tsv')
+                self.obj.progress_callback = lambda stage, work_done, total_work: cancellation_event.set() if stage == 'writing' else None
+                self.assertRaises(AnalysisCancelled, self.obj.writing_output, df_serial.copy(), significative_objects_serial)
+                self.assertEqual(os.listdir('.'), [])
+            finally:
+                os.chdir(current_directory)
+
     def test_correction_bonferroni(self):
         '''
         Datas are from : http://www.pmean.com/05/MultipleComparisons.asp
@@ -154,6 +309,50 @@ class enrichmentAnalysis_test(unittest.TestCase):
 
         np.testing.assert_array_equal(pvalue_df['pValueSGoF'].tolist(), pvalue_truth_df['pValueSGoF'].tolist())
 
+    def test_correction_storey(self):
+        '''
+        Datas have been created for the example: 900 uniform pvalues (true null hypotheses) and 100 small pvalues.
+        With one lambda of 0.5, pi0 is the number of pvalues higher than 0.5 divided by 1000 * 0.5.
+        '''
+        print("\nTesting Storey q-values ")
+        random_generator = np.random.default_rng(42)
+        pvalue_df = pa.DataFrame({'pvalue_hypergeometric': np.concatenate((random_generator.uniform(size=900),
+                                                                           random_generator.uniform(0, 0.001, size=100)))})
+        self.class_sgof_test.statistic_method = "pvalue_hypergeometric"
+
+        self.class_sgof_test.storey_lambdas = [0.5]
+        pvalue_df = self.class_sgof_test.correction_storey(pvalue_df)
+        pvalue_df = self.class_sgof_test.correction_benjamini_hochberg(pvalue_df)
+
+        self.assertAlmostEqual(self.class_sgof_test.pi0, (pvalue_df['pvalue_hypergeometric'] >= 0.5).sum() / 500)
+        np.testing.assert_array_almost_equal(pvalue_df['pValueStorey'], np.minimum(1, self.class_sgof_test.pi0 * pvalue_df['pValueBenjaminiHochberg']))
+        self.assertEqual(self.class_sgof_test.selection_object_with_adjusted_pvalue('Storey', pvalue_df),
+                         pvalue_df.index[pvalue_df['pValueStorey'] < 0.05].tolist())
+
+        self.class_sgof_test.storey_lambdas = np.arange(0.05, 0.96, 0.05)
+        for pi0_method in ['smoother', 'bootstrap']:
+            self.class_sgof_test.storey_pi0_method = pi0_method
+            self.class_sgof_test.storey_random_state = 1
+            pvalue_df = self.class_sgof_test.correction_storey(pvalue_df)
+            self.assertTrue(0.8 < self.class_sgof_test.pi0 < 1)
+            self.assertTrue((pvalue_df['pValueStorey'] <= pvalue_df['pValueBenjaminiHochberg'] + 1e-12).all())
+
+        pi0_bootstrap = self.class_sgof_test.pi0
+        self.class_sgof_test.correction_storey(pvalue_df)
+        self.assertEqual(self.class_sgof_test.pi0, pi0_bootstrap)
+
+        # All the pvalues are lower than the smallest lambda: pi0 falls back to 1 instead of stopping the analysis.
+        counts_df = pa.DataFrame({'Counts': [10, 12, 9], 'CountsReference': [12, 14, 10]}, index=['GO:1', 'GO:2', 'GO:3'])
+        for pi0_method in ['smoother', 'bootstrap']:
+            enriched_analysis = EnrichmentAnalysisExperimental(counts_df, 'Counts', 'CountsReference', 40, 1000, 0.05, 10000)
+            enriched_analysis.storey_pi0_method = pi0_method
+            df, significative_objects = enriched_analysis.compute_enrichment()
+
+            self.assertEqual(enriched_analysis.pi0, 1)
+            self.assertTrue((df['pvalue_hypergeometric'] < 0.05).all())
+            self.assertEqual(sorted(significative_objects['Storey']), ['GO:1', 'GO:2', 'GO:3'])
+            self.assertEqual(sorted(significative_objects['BenjaminiHochberg']), ['GO:1', 'GO:2', 'GO:3'])
+
     def test_error_rate_adjustement_bonferroni(self):
         '''
         Datas and results are from : www.biostathandbook.com/multiplecomparisons.html
@@ -0,0 +1,79 @@
+import itertools
+import numpy as np
+import scipy.stats as stats
+import unittest
+
+from pbsea import RankedEnrichmentAnalysis, exact_mhg_pvalues, minimum_hypergeometric_test
+from pbsea.ranked import hypergeometric_tails_computation
+
+
+class minimumHypergeometric_test(unittest.TestCase):
+
+    def setUp(self):
+        self.ranked_genes = ['g' + str(number) for number in range(30)]
+        self.gene_sets = {'GO:0000001': {'g0', 'g1', 'g2', 'g3'},
+                          'GO:0000002': {'g10', 'g20', 'g29'},
+                          'GO:0000003': {'g0', 'g15'},
+                          'GO:0000004': {'not_ranked'}}
+
+    def test_minimum_hypergeometric_test(self):
+        print("\nTesting minimum hypergeometric test ")
+        df = minimum_hypergeometric_test(self.ranked_genes, self.gene_sets)
+
+        self.assertNotIn('GO:0000004', df.index)
+        self.assertEqual(df.loc['GO:0000001', 'OptimalCutoff'], 4)
+        self.assertEqual(df.loc['GO:0000002', 'OptimalCutoff'], 11)
+        np.testing.assert_almost_equal(df.loc['GO:0000003', 'mHG'], stats.hypergeom.sf(0, 30, 2, 1))
+
+        # An object without gene above maximum_cutoff has no optimal cutoff.
+        self.gene_sets['GO:0000005'] = {'g20', 'g25'}
+        df = minimum_hypergeometric_test(self.ranked_genes, self.gene_sets, maximum_cutoff=10)
+        self.assertEqual(df.loc['GO:0000005', ['OptimalCutoff', 'Counts']].tolist(), [0, 0])
+        self.assertEqual(df.loc['GO:0000005', ['mHG', 'pvalue_mHG']].tolist(), [1, 1])
+        self.assertEqual(df.loc['GO:0000001', 'OptimalCutoff'], 4)
+        self.assertTrue((df['OptimalCutoff'] <= 10).all())
+
+    def test_hypergeometric_tails_computation(self):
+        print("\nTesting hypergeometric tails computation ")
+        for number_of_genes in [30, 20000]:
+            points = [(hits, object_size, cutoff) for object_size in [1, 2, 7, 25] for cutoff in [1, 3, 15, 29, 30]
+                      for hits in range(1, min(object_size, cutoff) + 2)]
+            hits, object_sizes, cutoffs = [np.array(values) for values in zip(*points)]
+            cutoffs = cutoffs * (number_of_genes // 30)
+            object_sizes = object_sizes * (number_of_genes // 30)
+
+            np.testing.assert_allclose(hypergeometric_tails_computation(hits, object_sizes, cutoffs, number_of_genes),
+                                       stats.hypergeom.sf(hits - 1, number_of_genes, object_sizes, cutoffs), rtol=1e-10)
+
+    def test_exact_mhg_pvalues(self):
+        '''
+        The exact pvalues are compared to the enumeration of all the rankings of 12 genes.
+        '''
+        print("\nTesting exact mHG pvalues ")
+        number_of_genes = 12
+        for object_size in [1, 3, 5]:
+            for maximum_cutoff in [6, 12]:
+                mhg_values = []
+                for ranks in itertools.combinations(range(number_of_genes), object_size):
+                    tails = [stats.hypergeom.sf(hit, number_of_genes, object_size, rank + 1)
+                             for hit, rank in enumerate(ranks) if rank < maximum_cutoff]
+                    mhg_values.append(min(tails + [1]))
+                mhg_values = np.array(mhg_values)
+                observed_mhg_values = mhg_values[[0, len(mhg_values) // 3, len(mhg_values) // 2]]
+
+                expected_pvalues = [(mhg_values <= mhg_value * (1 + 1e-9)).mean() for mhg_value in observed_mhg_values]
+                pvalues = exact_mhg_pvalues(observed_mhg_values, [object_size] * 3, number_of_genes, maximum_cutoff)
+
+                np.testing.assert_array_almost_equal(pvalues, expected_pvalues)
+
+    def test_ranked_enrichment_analysis(self):
+        print("\nTesting ranked enrichment analysis ")
+        analysis = RankedEnrichmentAnalysis(self.ranked_genes, self.gene_sets, 0.05)
+        df = analysis.test_on_dataframe(analysis.dataframe)
+        df, significative_objects = analysis.multiple_testing_correction(df)
+
+        self.assertEqual(df.index.tolist(), ['GO:0000001', 'GO:0000003', 'GO:0000002'])
+        self.assertEqual(significative_objects['BenjaminiHochberg'], ['GO:0000001'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import numpy as np
+import os
+import pandas as pa
+import tempfile
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from pbsea import EnrichmentReference, PandasBasedEnrichmentAnalysis, ReferenceSnapshot, enrichment_analysis_on_reference, \
+                  preprocessing_files, reference_snapshot_creation
+
+test_data_directory = 'test_data/'
+test_data_directory_enrichment = test_data_directory + 'test_enrichment/'
+test_data_directory_annotation = test_data_directory + 'test_annotation/'
+
+class enrichmentReference_test(unittest.TestCase):
+
+    def setUp(self):
+        self.df, self.column_interest, self.column_reference = preprocessing_files('GOs',
+            test_data_directory_enrichment+'counting_objects_in_interest.tsv',
+            test_data_directory_enrichment+'counting_objects_in_genome.tsv')
+        self.reference = EnrichmentReference.from_dataframe(self.df, self.column_reference, 1293)
+
+    def test_enrichment_analysis_on_reference(self):
+        print("\nTesting enrichment analysis on a shared reference ")
+        analysis = PandasBasedEnrichmentAnalysis(self.df, self.column_interest, self.column_reference, 122, 1293, 0.05, 10000)
+        df_expected, significative_objects_expected = analysis.compute_enrichment()
+
+        df, significative_objects = enrichment_analysis_on_reference(self.reference, self.df[self.column_interest],
+                                                                     122, 0.05, 10000, name_column_interest=self.column_interest)
+
+        pa.testing.assert_frame_equal(df, df_expected)
+        self.assertEqual(significative_objects, significative_objects_expected)
+
+    def test_concurrent_analyses(self):
+        print("\nTesting concurrent analyses on a shared reference ")
+        reference_counts = self.reference.reference_counts.copy()
+        interest_lists = [self.df[self.column_interest].iloc[start:] for start in range(8)]
+
+        expected_results = [enrichment_analysis_on_reference(self.reference, interest_counts, 122, 0.05, 10000)[0]
+                            for interest_counts in interest_lists]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda interest_counts: enrichment_analysis_on_reference(self.reference, interest_counts,
+                                                                                                 122, 0.05, 10000)[0],
+                                        interest_lists * 4))
+
+        for result_index, df in enumerate(results):
+            pa.testing.assert_frame_equal(df, expected_results[result_index % len(interest_lists)])
+        np.testing.assert_array_equal(self.reference.reference_counts, reference_counts)
+
+    def test_reference_from_snapshot(self):
+        print("\nTesting reference created from a snapshot ")
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            path_snapshot = os.path.join(temporary_directory, 'reference.snapshot')
+            reference_snapshot_creation('Genes', 'GOs', test_data_directory_annotation + 'genes_annotation.tsv', path_snapshot)
+
+            snapshot = ReferenceSnapshot(path_snapshot)
+            reference = EnrichmentReference.from_snapshot(snapshot)
+            interest_counts, number_of_genes_in_interest = reference.counting_objects_in_interest(['Gene_1', 'Gene_2', 'Gene_3'])
+
+            self.assertEqual(number_of_genes_in_interest, 3)
+            self.assertEqual(interest_counts.to_dict(), {'GO:0006779': 3, 'GO:0006783': 2, 'GO:0042168': 1})
+            self.assertEqual(reference.dataframe_of_interest(interest_counts)['CountsReference'].tolist(), [3, 3, 3])
+
+            del reference, interest_counts
+            snapshot.close()
+
+if __name__ == '__main__':
+    unittest.main()
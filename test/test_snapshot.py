@@ -0,0 +1,50 @@
+import numpy as np
+import os
+import tempfile
+import unittest
+
+from pbsea import ReferenceSnapshot, counting_objects, gene_sets_dictionary_creation, reference_snapshot_creation
+
+test_data_directory = 'test_data/'
+test_data_directory_annotation = test_data_directory + 'test_annotation/'
+
+class referenceSnapshot_test(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.path_snapshot = os.path.join(self.temporary_directory.name, 'reference.snapshot')
+        reference_snapshot_creation('Genes', 'GOs', test_data_directory_annotation + 'genes_annotation.tsv',
+                                    self.path_snapshot, number_of_genes_in_reference=8)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_reference_snapshot(self):
+        print("\nTesting reference snapshot reading ")
+        gene_sets = gene_sets_dictionary_creation('Genes', 'GOs', test_data_directory_annotation + 'genes_annotation.tsv')
+
+        with ReferenceSnapshot(self.path_snapshot) as snapshot:
+            self.assertEqual(snapshot.number_of_genes_in_reference, 8)
+            self.assertEqual(snapshot.object_ids, sorted(gene_sets))
+            self.assertFalse(snapshot.reference_counts.flags.writeable)
+
+            incidence_matrix = snapshot.incidence_matrix
+            genes = snapshot.gene_ids
+            for row, analyzed_object in enumerate(snapshot.object_ids):
+                self.assertEqual({genes[column] for column in incidence_matrix[row].indices}, gene_sets[analyzed_object])
+            del incidence_matrix
+
+    def test_counting_objects_in_interest(self):
+        print("\nTesting counting objects with a reference snapshot ")
+        df_int, df_ref = counting_objects('Genes', 'GOs', test_data_directory_annotation + 'genes_interest.tsv',
+                                          test_data_directory_annotation + 'genes_annotation.tsv')
+
+        with ReferenceSnapshot(self.path_snapshot) as snapshot:
+            df, number_of_genes_in_interest = snapshot.counting_objects_in_interest(['Gene_1', 'Gene_2', 'Gene_3', 'Gene_unknown'])
+
+        self.assertEqual(number_of_genes_in_interest, 3)
+        np.testing.assert_array_equal(df['count_int'].sort_index().values, df_int['count_int'].sort_index().values)
+        np.testing.assert_array_equal(df['count_ref'].values, df_ref.loc[df.index, 'count_ref'].values)
+
+if __name__ == '__main__':
+    unittest.main()
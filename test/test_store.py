@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from pbsea import EnrichmentReference, EnrichmentResultStore, ReferenceSnapshot, batch_enrichment_analysis, enrichment_analysis_on_reference, \
+                  reference_snapshot_creation
+
+test_data_directory = 'test_data/'
+test_data_directory_annotation = test_data_directory + 'test_annotation/'
+
+class enrichmentResultStore_test(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.path_store = os.path.join(self.temporary_directory.name, 'result_store')
+        self.path_snapshot = os.path.join(self.temporary_directory.name, 'reference.snapshot')
+        reference_snapshot_creation('Genes', 'GOs', test_data_directory_annotation + 'genes_annotation.tsv', self.path_snapshot)
+        self.manifest = {'list_1': ['Gene_1', 'Gene_2', 'Gene_3'], 'list_2': ['Gene_4', 'Gene_5'], 'list_3': ['Gene_2', 'Gene_6', 'Gene_7']}
+
+        self.results = {}
+        with ReferenceSnapshot(self.path_snapshot) as snapshot:
+            reference = EnrichmentReference.from_snapshot(snapshot)
+            for list_name, interest_genes in self.manifest.items():
+                interest_counts, number_of_genes_found = reference.counting_objects_in_interest(interest_genes)
+                self.results[list_name] = enrichment_analysis_on_reference(reference, interest_counts, number_of_genes_found, 0.05, 10000)[0]
+            del reference, interest_counts
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def expected_rows(self, column_name, maximum_value):
+        return sorted((list_name, analyzed_object) for list_name, df in self.results.items()
+                      for analyzed_object, value in df[column_name].items() if value < maximum_value)
+
+    def test_querying_object(self):
+        print("\nTesting querying of an object in the result store ")
+        with EnrichmentResultStore(self.path_store) as result_store:
+            with result_store.opening_run('run_1', maximum_segment_rows=5) as run_writer:
+                for list_name, df in self.results.items():
+                    run_writer.appending_result(list_name, df)
+
+            analyzed_object = self.results['list_1'].index[0]
+            df_object = result_store.querying_object(analyzed_object)
+            self.assertEqual(sorted(df_object['ListName']),
+                             sorted(list_name for list_name, df in self.results.items() if analyzed_object in df.index))
+            for list_name, value in zip(df_object['ListName'], df_object['pvalue_hypergeometric']):
+                self.assertAlmostEqual(value, self.results[list_name].loc[analyzed_object, 'pvalue_hypergeometric'])
+
+            maximum_value = self.results['list_1'].loc[analyzed_object, 'pvalue_hypergeometric'] + 1e-12
+            df_object = result_store.querying_object(analyzed_object, 'pvalue_hypergeometric', maximum_value)
+            self.assertTrue((df_object['pvalue_hypergeometric'] < maximum_value).all())
+            self.assertIn('list_1', df_object['ListName'].tolist())
+
+            self.assertEqual(len(result_store.querying_object('GO:unknown').index), 0)
+
+    def test_querying_threshold(self):
+        print("\nTesting querying of a threshold in the result store ")
+        with EnrichmentResultStore(self.path_store) as result_store:
+            result_store.appending_results('run_1', {'list_1': self.results['list_1'], 'list_2': self.results['list_2']})
+            result_store.appending_results('run_2', {'list_3': self.results['list_3']})
+
+            # The store is append-only and is read again from the disk.
+            with EnrichmentResultStore(self.path_store) as reopened_store:
+                self.assertEqual(reopened_store.runs(), ['run_1', 'run_2'])
+
+                df_significant = reopened_store.querying_threshold('pvalue_hypergeometric', 0.5)
+                self.assertEqual(sorted(zip(df_significant['ListName'], df_significant['AnalyzedObject'])),
+                                 self.expected_rows('pvalue_hypergeometric', 0.5))
+
+                df_significant = reopened_store.querying_threshold('pvalue_hypergeometric', 2, run_ids=['run_2'])
+                self.assertEqual(set(df_significant['RunID']), {'run_2'})
+                self.assertEqual(len(df_significant.index), len(self.results['list_3'].index))
+
+                self.assertEqual(len(reopened_store.querying_threshold('pvalue_hypergeometric', 0).index), 0)
+
+    def test_appending_result_files(self):
+        print("\nTesting appending of batch result files in the result store ")
+        output_directory = os.path.join(self.temporary_directory.name, 'results')
+        batch_enrichment_analysis(self.path_snapshot, self.manifest, output_directory, 0.05, 10000)
+        result_files = {list_name: os.path.join(output_directory, 'results_' + list_name + '_over.tsv') for list_name in self.manifest}
+
+        with EnrichmentResultStore(self.path_store) as result_store:
+            result_store.appending_result_files('batch', result_files)
+            df_significant = result_store.querying_threshold('pvalue_hypergeometric', 0.5)
+
+        self.assertEqual(sorted(zip(df_significant['ListName'], df_significant['AnalyzedObject'])),
+                         self.expected_rows('pvalue_hypergeometric', 0.5))
+        self.assertFalse(any(file_name.endswith('.tmp') for file_name in os.listdir(os.path.join(self.path_store, 'runs', 'batch'))))
+
+if __name__ == '__main__':
+    unittest.main()
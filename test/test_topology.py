@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.stats as stats
+import unittest
+
+from pbsea import TopologyEnrichmentAnalysis, topological_order
+
+
+class topologyEnrichmentAnalysis_test(unittest.TestCase):
+    '''
+    Graph used: GO:0000001 (root) <- GO:0000002 <- GO:0000003 (leaf) and GO:0000001 <- GO:0000004 (leaf).
+    All the genes of GO:0000003 are in the interest.
+    '''
+
+    def setUp(self):
+        self.object_parents = {'GO:0000002': ['GO:0000001'], 'GO:0000003': ['GO:0000002'], 'GO:0000004': ['GO:0000001']}
+        self.gene_sets = {'GO:0000003': {'g1', 'g2', 'g3', 'g4', 'g5'},
+                          'GO:0000002': {'g6', 'g7', 'g8'},
+                          'GO:0000004': {'g9', 'g10', 'g11', 'g12', 'g13', 'g14'},
+                          'GO:0000001': {'g15', 'g16', 'g17', 'g18', 'g19', 'g20'}}
+        self.interest_genes = ['g1', 'g2', 'g3', 'g4', 'g5', 'g9']
+        self.labels = {'GO:0000001': 'root', 'GO:0000002': 'parent', 'GO:0000003': 'leaf', 'GO:0000004': 'other leaf'}
+
+    def test_topological_order(self):
+        print("\nTesting topological order of the GO graph ")
+        sorted_objects = topological_order(self.object_parents, ['GO:0000003', 'GO:0000004'])
+
+        self.assertEqual(sorted_objects[-1], 'GO:0000001')
+        self.assertLess(sorted_objects.index('GO:0000003'), sorted_objects.index('GO:0000002'))
+
+    def test_elim(self):
+        print("\nTesting elim algorithm ")
+        analysis = TopologyEnrichmentAnalysis(self.gene_sets, self.object_parents, self.interest_genes, 0.05, self.labels, 'GO')
+        df = analysis.test_on_dataframe(analysis.dataframe.copy())
+
+        np.testing.assert_almost_equal(df.loc['GO:0000003', 'pvalue_elim'], stats.hypergeom.sf(4, 20, 5, 6))
+        # The genes of the leaf are removed from its parent, which has no gene of interest left
+        # (while the classic test of the parent is significant).
+        self.assertEqual(df.loc['GO:0000002', 'pvalue_elim'], 1)
+        self.assertLess(stats.hypergeom.sf(4, 20, 8, 6), 0.05)
+
+    def test_weight(self):
+        print("\nTesting weight algorithm ")
+        analysis = TopologyEnrichmentAnalysis(self.gene_sets, self.object_parents, self.interest_genes, 0.05, self.labels, 'GO',
+                                              algorithm='weight')
+        df = analysis.test_on_dataframe(analysis.dataframe.copy())
+
+        self.assertEqual(df.index[0], 'GO:0000003')
+        self.assertGreater(df.loc['GO:0000002', 'pvalue_weight'], stats.hypergeom.sf(4, 20, 8, 6))
+
+        # The parent is more significant than its leaf, so the genes of the leaf are down-weighted in the leaf.
+        self.gene_sets['GO:0000003'] = {'g1', 'g10', 'g11'}
+        self.gene_sets['GO:0000002'] = {'g2', 'g3', 'g4', 'g5', 'g6'}
+        self.gene_sets['GO:0000004'] = {'g9', 'g12', 'g13', 'g14'}
+        self.interest_genes = ['g1', 'g2', 'g3', 'g4', 'g5', 'g6']
+        analysis = TopologyEnrichmentAnalysis(self.gene_sets, self.object_parents, self.interest_genes, 0.05, self.labels, 'GO',
+                                              algorithm='weight')
+        df = analysis.test_on_dataframe(analysis.dataframe.copy())
+
+        np.testing.assert_almost_equal(df.loc['GO:0000002', 'pvalue_weight'], stats.hypergeom.sf(5, 18, 8, 6))
+        self.assertGreater(df.loc['GO:0000003', 'pvalue_weight'], stats.hypergeom.sf(0, 18, 3, 6))
+
+    def test_parent_child(self):
+        print("\nTesting parent-child algorithm ")
+        analysis = TopologyEnrichmentAnalysis(self.gene_sets, self.object_parents, self.interest_genes, 0.05, self.labels, 'GO',
+                                              algorithm='parent_child')
+        df = analysis.test_on_dataframe(analysis.dataframe.copy())
+        df, significative_objects = analysis.multiple_testing_correction(df)
+
+        # The leaf is tested against the 8 genes of its parent, which contains 5 genes of interest.
+        np.testing.assert_almost_equal(df.loc['GO:0000003', 'pvalue_parent_child'], 1 / 56)
+        self.assertIn('GO', df.columns)
+
+if __name__ == '__main__':
+    unittest.main()